@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+PRODUCTS_DIR = "../../data/jihwan/products"
+CATALOG_PATH = "../../../data/final/product_catalog.json"
+FIELDS = ["name", "image_url", "url", "category"]
+
+
+def product_id_from_url(url):
+    # the same id crawler_product_info.py records, taken from the product page's goodsNo parameter
+    if not isinstance(url, str):
+        return None
+    return parse_qs(urlparse(url).query).get("goodsNo", [None])[0]
+
+
+def read_product_file(path):
+    products = pd.read_csv(path)
+    # files crawled before product_id / image_url were recorded: derive the id from the url, leave the rest empty
+    if "product_id" not in products:
+        if "url" not in products:
+            print(f"Skipping {path}: no product_id or url column")
+            return None
+        products["product_id"] = products["url"].map(product_id_from_url)
+    if "product_name" not in products:
+        print(f"Skipping {path}: no product_name column")
+        return None
+    for column in ["image_url", "url", "category"]:
+        if column not in products:
+            products[column] = None
+    return products
+
+
+def read_products(products_dir):
+    frames = [read_product_file(os.path.join(products_dir, file)) for file in sorted(os.listdir(products_dir)) if file.endswith(".csv")]
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return {}
+    products = pd.concat(frames, ignore_index=True).dropna(subset=["product_id"])
+    products = products.astype(object).where(products.notna(), None)
+
+    entries = {}
+    for row in products.itertuples(index=False):
+        entries[row.product_id] = {
+            "name": row.product_name,
+            "image_url": row.image_url,
+            "url": row.url,
+            "category": row.category,
+        }
+    return entries
+
+
+def refresh_catalog(catalog, entries):
+    added, updated = 0, 0
+    for product_id, entry in entries.items():
+        current = catalog.get(product_id, {})
+        # a re-crawl that missed a field keeps what we already had
+        merged = {field: entry[field] if entry[field] is not None else current.get(field) for field in FIELDS}
+        if merged == current:
+            continue
+        if current:
+            updated += 1
+        else:
+            added += 1
+        catalog[product_id] = merged
+    return added, updated
+
+
+if __name__ == "__main__":
+    products_dir = sys.argv[1] if len(sys.argv) > 1 else PRODUCTS_DIR
+    catalog_path = sys.argv[2] if len(sys.argv) > 2 else CATALOG_PATH
+
+    catalog = {}
+    if os.path.exists(catalog_path):
+        with open(catalog_path, "r", encoding="utf-8") as f:
+            catalog = json.load(f)
+
+    added, updated = refresh_catalog(catalog, read_products(products_dir))
+    print(f"{added} added, {updated} updated, {len(catalog)} products in {catalog_path}")
+
+    if added or updated:
+        with open(f"{catalog_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(catalog, f, ensure_ascii=False)
+        os.replace(f"{catalog_path}.tmp", catalog_path)
@@ -3,6 +3,7 @@ import time
 from collections import defaultdict
 import logging
 import sys
+from urllib.parse import urlparse, parse_qs
 
 import pandas as pd
 from tqdm import tqdm
@@ -105,6 +106,9 @@ def extract_product_info(driver, url):
     product_name = extract_element_text(driver, product_info, "p.prd_name", url, False)
     product_flags = extract_element_text_list(driver, product_info, "p.prd_flag span", url, False)
 
+    image = extract_element(driver, driver, "div.prd_img img", url, False)
+    image_url = image.get_attribute("src") if image is not None else None
+
     review_cnt_txt = extract_element_text(driver, product_social_info, "p#repReview > em", url, False)
     review_cnt = int(review_cnt_txt.strip("()").strip("건").replace(",", ""))
     overall_rating = float(extract_element_text(driver, product_social_info, "p#repReview > b", url, False))
@@ -116,6 +120,7 @@ def extract_product_info(driver, url):
         "brand_name": brand_name,
         "product_name": product_name,
         "product_flag": ",".join(product_flags),
+        "image_url": image_url,
         "url": url,
         "review_cnt": review_cnt,
         "overall_rating": overall_rating
@@ -175,11 +180,13 @@ def scrape_product_reviews(product_url_dict, position=1):
             logging.info("[%s] Ingredients are %s", HEADER, ingredients)
 
             product_info_dict["category"].append(cat_name)
+            product_info_dict["product_id"].append(parse_qs(urlparse(url).query).get("goodsNo", [None])[0])
             product_info_dict["product_name"].append(product_info["product_name"])
             product_info_dict["brand_name"].append(product_info["brand_name"])
             product_info_dict["product_flag"].append(product_info["product_flag"])
             product_info_dict["review_cnt"].append(product_info["review_cnt"])
             product_info_dict["overall_rating"].append(product_info["overall_rating"])
+            product_info_dict["image_url"].append(product_info["image_url"])
             product_info_dict["url"].append(url)
             product_info_dict["ingredients"].append(ingredients)
                 
@@ -0,0 +1,61 @@
+import asyncio
+
+from metrics import SIZE_BUCKETS, metrics
+
+
+class ScoringBatcher:
+    # coalesces the live-scoring requests that arrive within `window` seconds, or until `max_batch` are
+    # waiting, into one score_many call, i.e. a single matrix-matrix product, and hands each request its row
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.timer = None
+        self.waiting = 0
+        self.tasks = set()
+
+    async def score(self, scorer, user_code):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((scorer, user_code, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+
+        self.waiting += 1
+        try:
+            return await future
+        finally:
+            self.waiting -= 1
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        metrics.observe("scoring_batch_size", len(batch), buckets=SIZE_BUCKETS)
+        # a model swap can land mid-window; each request is scored by the model it started on
+        by_scorer = {}
+        for scorer, user_code, future in batch:
+            by_scorer.setdefault(id(scorer), (scorer, []))[1].append((user_code, future))
+
+        for scorer, requests in by_scorer.values():
+            try:
+                with metrics.timer("score_batched"):
+                    scores = await asyncio.to_thread(scorer.score_many, [user_code for user_code, _ in requests])
+            except Exception as e:
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            # a request whose client went away has had its future cancelled already
+            for row, (_, future) in enumerate(requests):
+                if not future.done():
+                    future.set_result(scores[row])
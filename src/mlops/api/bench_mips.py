@@ -0,0 +1,53 @@
+import argparse
+import time
+
+import numpy as np
+
+from model import models
+from mips_index import IVFIndex
+from scorer import top_n
+
+scorer = models.current.scorer
+
+
+def synthetic_items(n_items, seed):
+    # draw extra items from a gaussian fitted to the trained item factors to emulate a larger catalog
+    rng = np.random.default_rng(seed)
+    vectors = np.hstack([scorer.qi, scorer.bi[:, None]])
+    sampled = rng.multivariate_normal(vectors.mean(axis=0), np.cov(vectors, rowvar=False), size=n_items)
+    return sampled[:, :-1], sampled[:, -1]
+
+
+def main(n_items, n_users, n, nprobes, seed):
+    qi, bi = (scorer.qi, scorer.bi) if n_items is None else synthetic_items(n_items, seed)
+    rng = np.random.default_rng(seed)
+    users = scorer.pu[rng.choice(len(scorer.pu), min(n_users, len(scorer.pu)), replace=False)]
+    queries = np.hstack([users, np.ones((len(users), 1))])
+    item_vectors = np.hstack([qi, bi[:, None]])
+
+    started = time.perf_counter()
+    index = IVFIndex(qi, bi)
+    print(f"items={len(qi)} lists={index.n_lists} build={time.perf_counter() - started:.3f}s")
+
+    started = time.perf_counter()
+    exact = [top_n(item_vectors @ query, n) for query in queries]
+    print(f"exact      latency={(time.perf_counter() - started) / len(queries) * 1e3:.3f}ms recall@{n}=1.000")
+
+    for nprobe in nprobes:
+        started = time.perf_counter()
+        approx = [index.query(query, n, nprobe)[0] for query in queries]
+        latency = (time.perf_counter() - started) / len(queries)
+        recall = np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact)])
+        print(f"nprobe={nprobe:<4} latency={latency * 1e3:.3f}ms recall@{n}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=None, help="benchmark against a synthetic catalog of this size")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.items, args.users, args.n, args.nprobe, args.seed)
@@ -0,0 +1,54 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.stats import spearmanr
+
+from data_loader import product_names
+from model_loader import load_model
+from quantize import QuantizedFactors
+from scorer import Scorer, top_n
+
+MODEL_PATH = "../../../data/model/model.pkl"
+
+
+def with_item_factors(scorer, qi):
+    return Scorer(
+        scorer.global_mean, (scorer.lower_bound, scorer.higher_bound), scorer.user_inner_ids,
+        scorer.pu, scorer.bu, qi, scorer.bi, scorer.version,
+    )
+
+
+def main(model_path, n_users, n, seed):
+    # the reference comes from the trained model rather than the served artifact, which may itself be quantized
+    full = Scorer.from_surprise(load_model(model_path), product_names, "reference")
+    rng = np.random.default_rng(seed)
+    user_codes = list(full.user_inner_ids)
+    user_codes = [user_codes[i] for i in rng.choice(len(user_codes), min(n_users, len(user_codes)), replace=False)]
+    exact = full.score_many(user_codes)
+    exact_top = [top_n(row, n) for row in exact]
+
+    for dtype in ["float64", "float16", "int8"]:
+        qi = full.qi if dtype == "float64" else QuantizedFactors.quantize(full.qi, dtype)
+        reduced = with_item_factors(full, qi)
+
+        started = time.perf_counter()
+        for user_code in user_codes:
+            reduced.score(user_code)
+        latency = (time.perf_counter() - started) / len(user_codes)
+
+        scores = reduced.score_many(user_codes)
+        recall = np.mean([len(np.intersect1d(top_n(row, n), e)) / len(e) for row, e in zip(scores, exact_top)])
+        correlation = np.mean([spearmanr(row, e).statistic for row, e in zip(scores, exact)])
+        print(f"{dtype:<8} item_factors={qi.nbytes / 2 ** 20:.2f}MB latency={latency * 1e3:.3f}ms recall@{n}={recall:.4f} spearman={correlation:.5f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.model, args.users, args.n, args.seed)
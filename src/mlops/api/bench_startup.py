@@ -0,0 +1,36 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+# each run is a fresh interpreter importing the app, which is what `uvicorn main:app` does on start
+PROBE = """
+import time
+started = time.perf_counter()
+import data_loader
+data_loader.load_history(); data_loader.load_products()
+loaded = time.perf_counter()
+import main
+print(loaded - started, time.perf_counter() - started)
+"""
+
+
+def main(runs):
+    data_times, total_times = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], check=True, capture_output=True, text=True).stdout
+        data_time, total_time = map(float, output.split()[-2:])
+        data_times.append(data_time)
+        total_times.append(total_time)
+
+    print(f"runs={runs}")
+    print(f"data load  median={statistics.median(data_times) * 1e3:.1f}ms max={max(data_times) * 1e3:.1f}ms")
+    print(f"app import median={statistics.median(total_times) * 1e3:.1f}ms max={max(total_times) * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args.runs)
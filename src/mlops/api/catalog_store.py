@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CATALOG_DB = "../../../data/final/catalog.db"
+
+SCHEMA = """
+CREATE TABLE products (
+    position INTEGER PRIMARY KEY,
+    product_id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    url TEXT,
+    image_url TEXT,
+    category TEXT
+);
+CREATE INDEX products_name ON products (name);
+CREATE INDEX products_category ON products (category, position);
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    user_code TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX users_code ON users (user_code);
+"""
+
+
+class CatalogStore:
+    # product id <-> name <-> url / image / category and user id <-> code, answered by indexed queries
+    # against one sqlite file instead of whole dicts per process; the streamlit app reads the same file
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path=CATALOG_DB):
+        return cls(sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False))
+
+    @classmethod
+    def build(cls, path, product_ids, product_names, catalog, user_id2code):
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.executescript(SCHEMA)
+        connection.executemany(
+            "INSERT INTO products VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (position, str(product_id), str(name), entry.get("url"), entry.get("image_url"), entry.get("category"))
+                for position, (product_id, name) in enumerate(zip(product_ids, product_names))
+                for entry in [catalog.get(str(product_id), {})]
+            ),
+        )
+        connection.executemany("INSERT INTO users VALUES (?, ?)", user_id2code.items())
+        connection.commit()
+        return cls(connection)
+
+    def query(self, sql, *args):
+        with self.lock:
+            return self.connection.execute(sql, args).fetchall()
+
+    def scalar(self, sql, *args):
+        rows = self.query(sql, *args)
+        return rows[0][0] if rows else None
+
+    def product_id(self, name):
+        return self.scalar("SELECT product_id FROM products WHERE name = ?", name)
+
+    def product_name(self, product_id):
+        return self.scalar("SELECT name FROM products WHERE product_id = ?", product_id)
+
+    def position(self, product_id):
+        return self.scalar("SELECT position FROM products WHERE product_id = ?", product_id)
+
+    def image_url(self, product_id):
+        return self.scalar("SELECT image_url FROM products WHERE product_id = ?", product_id)
+
+    def product(self, product_id):
+        rows = self.query("SELECT product_id, name, url, image_url, category FROM products WHERE product_id = ?", product_id)
+        return dict(zip(["product_id", "name", "url", "image_url", "category"], rows[0])) if rows else None
+
+    def category_positions(self):
+        return self.query("SELECT category, position FROM products WHERE category IS NOT NULL ORDER BY category, position")
+
+    def user_code(self, user_id):
+        return self.scalar("SELECT user_code FROM users WHERE user_id = ?", user_id)
+
+    def close(self):
+        self.connection.close()
+
+
+def build_catalog_db(path=CATALOG_DB):
+    from data_loader import DATA_DIR, load_product_catalog, load_products
+
+    product_ids, product_names = load_products()
+    user_id2code = {}
+    if os.path.exists(f"{DATA_DIR}/user_id2code.json"):
+        with open(f"{DATA_DIR}/user_id2code.json", "r", encoding="utf-8") as f:
+            user_id2code = json.load(f)
+
+    if os.path.exists(f"{path}.tmp"):
+        os.remove(f"{path}.tmp")
+    CatalogStore.build(f"{path}.tmp", product_ids, product_names, load_product_catalog(), user_id2code).close()
+    os.replace(f"{path}.tmp", path)
+    return len(product_ids), len(user_id2code)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else CATALOG_DB
+    started = time.time()
+    n_products, n_users = build_catalog_db(path)
+    print(f"Wrote {n_products} products and {n_users} users to {path} in {time.time() - started:.1f}s")
@@ -1,8 +1,147 @@
-import pandas as pd
+import os
 import json
+import sys
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from catalog_store import CATALOG_DB, CatalogStore
+
+DATA_DIR = "../../../data/final"
+HISTORY_CSV = f"{DATA_DIR}/purchase_history_rating.csv"
+HISTORY_PARQUET = f"{DATA_DIR}/purchase_history.parquet"
+PRODUCTS_PARQUET = f"{DATA_DIR}/products.parquet"
+HISTORY_COLUMNS = ["user_code", "product_id", "review_rating", "review_date"]
+
+# set by serve.py: a directory of pre-built arrays that every worker memory-maps instead of loading its own copy
+SERVING_DIR = os.environ.get("SERVING_DIR")
+
+
+def read_history_snapshot():
+    # the snapshot and the purchase log offset it already includes, read from one file so they agree
+    table = pq.read_table(HISTORY_PARQUET, columns=HISTORY_COLUMNS)
+    return table.to_pandas(), int((table.schema.metadata or {}).get(b"log_offset", 0))
+
+
+def save_history(history, log_offset):
+    table = pa.Table.from_pandas(history, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"log_offset": str(log_offset).encode()})
+    pq.write_table(table, f"{HISTORY_PARQUET}.tmp")
+    os.replace(f"{HISTORY_PARQUET}.tmp", HISTORY_PARQUET)
+
+
+@lru_cache(maxsize=None)
+def load_history():
+    # the parquet snapshot holds only the columns the API needs, with user and product ids
+    # dictionary-encoded; the full csv is the fallback until a snapshot has been written.
+    # attrs["log_offset"] is where replaying the purchase log has to start from
+    if os.path.exists(HISTORY_PARQUET):
+        history, log_offset = read_history_snapshot()
+    else:
+        history, log_offset = pd.read_csv(HISTORY_CSV, usecols=HISTORY_COLUMNS), 0
+    history.attrs["log_offset"] = log_offset
+    return history
+
+
+@lru_cache(maxsize=None)
+def load_products():
+    if SERVING_DIR is not None:
+        path = os.path.join(SERVING_DIR, "products")
+        return np.load(os.path.join(path, "product_ids.npy"), mmap_mode="r"), np.load(os.path.join(path, "product_names.npy"), mmap_mode="r")
+
+    if os.path.exists(PRODUCTS_PARQUET):
+        products = pd.read_parquet(PRODUCTS_PARQUET)
+        return products["product_id"].to_numpy(dtype=object), list(products["product_name"])
+
+    product_ids = load_history()["product_id"].unique()
+    with open(f"{DATA_DIR}/product_id2name.json", "r", encoding="utf-8") as f:
+        product_id2name = json.load(f)
+    return product_ids, [product_id2name[product_id] for product_id in product_ids]
+
+
+@lru_cache(maxsize=None)
+def load_product_catalog():
+    # product_id -> name, image_url, url, category, built offline by src/crawler/jihwan/build_catalog.py
+    if not os.path.exists(f"{DATA_DIR}/product_catalog.json"):
+        return {}
+    with open(f"{DATA_DIR}/product_catalog.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def load_user_skintypes():
+    if not os.path.exists(f"{DATA_DIR}/final_user_profile.csv"):
+        return {}
+    profiles = pd.read_csv(f"{DATA_DIR}/final_user_profile.csv", usecols=["user_code", "user_skintype"]).dropna()
+    return dict(zip(profiles["user_code"], profiles["user_skintype"]))
+
+
+@lru_cache(maxsize=None)
+def load_catalog_store():
+    # catalog.db is written by catalog_store.py; until it exists each process builds an in-memory copy
+    if os.path.exists(CATALOG_DB):
+        return CatalogStore.open(CATALOG_DB)
+    product_ids, product_names = load_products()
+    return CatalogStore.build(":memory:", product_ids, product_names, load_product_catalog(), {})
+
+
+@lru_cache(maxsize=None)
+def load_category_items():
+    # category -> ascending catalog positions of its products
+    positions = {}
+    for category, idx in load_catalog_store().category_positions():
+        positions.setdefault(category, []).append(idx)
+    return {category: np.array(idx, dtype=np.int64) for category, idx in positions.items()}
+
+
+LAZY = {
+    "product_ids": lambda: load_products()[0],
+    "product_names": lambda: load_products()[1],
+    "catalog_store": load_catalog_store,
+    "category_items": load_category_items,
+    "user_skintypes": load_user_skintypes,
+}
+
+
+def __getattr__(name):
+    # module attributes are loaded on first access rather than at import time
+    if name not in LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = LAZY[name]()
+    globals()[name] = value
+    return value
+
+
+def write_products(path):
+    product_ids, product_names = load_products()
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "product_ids.npy"), np.asarray(product_ids, dtype=str))
+    np.save(os.path.join(path, "product_names.npy"), np.asarray(product_names, dtype=str))
+
+
+def write_snapshot():
+    history = pd.read_csv(HISTORY_CSV, usecols=HISTORY_COLUMNS)
+    product_ids = history["product_id"].unique()
+    history["product_id"] = pd.Categorical(history["product_id"], categories=product_ids)
+    history["user_code"] = history["user_code"].astype("category")
+    history["review_date"] = pd.to_datetime(history["review_date"], format="%Y.%m.%d")
+    # the csv has none of the logged purchases, so the whole log is replayed on top of this snapshot
+    save_history(history, 0)
+
+    with open(f"{DATA_DIR}/product_id2name.json", "r", encoding="utf-8") as f:
+        product_id2name = json.load(f)
+    products = pd.DataFrame({"product_id": product_ids, "product_name": [product_id2name[product_id] for product_id in product_ids]})
+    products.to_parquet(f"{PRODUCTS_PARQUET}.tmp", index=False)
+    os.replace(f"{PRODUCTS_PARQUET}.tmp", PRODUCTS_PARQUET)
+    return len(history), len(products)
 
-data = pd.read_csv("../../../data/final/purchase_history_rating.csv")
-product_ids = data["product_id"].unique()
 
-product_id2name = json.load(open("../../../data/final/product_id2name.json", "r", encoding="utf-8"))
-product_name2id = json.load(open("../../../data/final/product_name2id.json", "r", encoding="utf-8"))
+if __name__ == "__main__":
+    if sys.argv[1:] == ["snapshot"]:
+        started = time.time()
+        n_rows, n_products = write_snapshot()
+        print(f"Wrote {n_rows} purchases and {n_products} products to {DATA_DIR} in {time.time() - started:.1f}s")
@@ -0,0 +1,24 @@
+import numpy as np
+
+
+class SortedIdIndex:
+    # raw id -> row lookup over a sorted (usually memory-mapped) id array, so the map lives in the
+    # shared page cache instead of a per-worker dict; rows defaults to the position in the array
+    def __init__(self, ids, rows=None):
+        self.ids = ids
+        self.rows = rows
+
+    def get(self, raw_id, default=None):
+        pos = int(np.searchsorted(self.ids, raw_id))
+        if pos < len(self.ids) and self.ids[pos] == raw_id:
+            return int(self.rows[pos]) if self.rows is not None else pos
+        return default
+
+    def __contains__(self, raw_id):
+        return self.get(raw_id) is not None
+
+    def __iter__(self):
+        return (str(raw_id) for raw_id in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
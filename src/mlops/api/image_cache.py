@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+
+import diskcache
+
+
+class ImageCache:
+    def __init__(self, directory, ttl=7 * 24 * 3600, memory_entries=4096, size_limit=64 * 2 ** 20):
+        # the SQLite-backed disk layer survives restarts and is shared by every worker on the host;
+        # the small in-process LRU in front of it keeps hot products off SQLite entirely
+        self.disk = diskcache.Cache(directory, eviction_policy="least-recently-used", size_limit=size_limit)
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product_id):
+        entry = self.memory.get(product_id)
+        if entry is not None and entry[1] > time.time():
+            self.memory.move_to_end(product_id)
+            self.hits += 1
+            return entry[0]
+
+        url, expire_time = self.disk.get(product_id, expire_time=True)
+        if url is None:
+            self.memory.pop(product_id, None)
+            self.misses += 1
+            return None
+        self._remember(product_id, url, expire_time or time.time() + self.ttl)
+        self.hits += 1
+        return url
+
+    def set(self, product_id, url, ttl=None):
+        ttl = ttl or self.ttl
+        self.disk.set(product_id, url, expire=ttl)
+        self._remember(product_id, url, time.time() + ttl)
+
+    def _remember(self, product_id, url, expire_time):
+        self.memory[product_id] = (url, expire_time)
+        self.memory.move_to_end(product_id)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": len(self.disk),
+        }
+
+    def close(self):
+        self.disk.close()
@@ -1,23 +1,158 @@
-from bs4 import BeautifulSoup
-import requests
-from data_loader import product_name2id
-
-
-def get_image_urls(items, caches):
-    urls = []
-    for item in items:
-        if item not in caches:
-            page = "https://www.oliveyoung.co.kr/store/goods/getGoodsDetail.do?goodsNo={product_id}"
-            print(product_name2id[item[0]])
-            html = requests.get(page.format(product_id=product_name2id[item[0]]), timeout=100).text
-            soup = BeautifulSoup(html, "html.parser")
-            try:
-                url = soup.find("div", attrs={"class": "prd_img"}).find("img").attrs["src"]
-                caches[item] = url
-                urls.append(url)
-            except Exception:
-                urls.append(None)
-        else:
-            urls.append(caches[item])
-
-    return urls, caches
+import asyncio
+import os
+import time
+
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+from data_loader import catalog_store
+from metrics import metrics
+
+# point OLIVEYOUNG_BASE_URL at fake_oliveyoung.py for hermetic load tests
+PAGE = os.environ.get("OLIVEYOUNG_BASE_URL", "https://www.oliveyoung.co.kr") + "/store/goods/getGoodsDetail.do?goodsNo={product_id}"
+
+
+def parse_image_url(html):
+    soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("div", attrs={"class": "prd_img"}))
+    try:
+        return soup.find("div", attrs={"class": "prd_img"}).find("img").attrs["src"]
+    except Exception:
+        return None
+
+
+# cached for a product whose page had no image or failed to load, so it is not refetched (and waited on
+# for the whole deadline) on every request until the short negative ttl runs out
+NO_IMAGE = ""
+
+
+def known_image_url(product_id, cache):
+    # the crawled catalog answers without any outbound request; only products it is missing
+    # fall through to the cache and the page fetch
+    url = catalog_store.image_url(product_id)
+    if url is not None:
+        metrics.inc("image_lookups_total", source="catalog")
+        return url
+    url = cache.get(product_id)
+    metrics.inc("image_lookups_total", source="miss" if url is None else "negative" if url == NO_IMAGE else "cache")
+    return url
+
+
+class ImageResolver:
+    def __init__(self, concurrency=8, deadline=1.0, fetch_timeout=10, negative_ttl=600):
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.fetch_timeout = fetch_timeout
+        self.negative_ttl = negative_ttl
+        self.session = None
+        self.semaphore = None
+        self.in_flight = {}
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.fetch_timeout),
+        )
+
+    async def close(self):
+        for task in self.in_flight.values():
+            task.cancel()
+        await self.session.close()
+
+    async def fetch(self, product_id):
+        started = time.perf_counter()
+        try:
+            async with self.semaphore:
+                async with self.session.get(PAGE.format(product_id=product_id)) as response:
+                    response.raise_for_status()
+                    html = await response.text()
+            url = await asyncio.to_thread(parse_image_url, html)
+            metrics.inc("image_fetches_total", outcome="ok" if url is not None else "no_image")
+            return url
+        except Exception as e:
+            metrics.inc("image_fetches_total", outcome="error")
+            metrics.inc("image_fetch_errors_total", error=type(e).__name__)
+            return None
+        finally:
+            metrics.observe("stage_latency_seconds", time.perf_counter() - started, stage="image_fetch")
+
+    def resolve(self, product_id, cache):
+        # one fetch per product no matter how many requests are waiting on it; the task outlives
+        # the request that started it and fills the cache before it finishes
+        task = self.in_flight.get(product_id)
+        if task is None:
+            task = asyncio.create_task(self.fetch_and_store(product_id, cache))
+            self.in_flight[product_id] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(product_id, None))
+        return task
+
+    async def fetch_and_store(self, product_id, cache):
+        url = await self.fetch(product_id)
+        try:
+            # diskcache writes can wait on its sqlite lock, which other workers share; keep that off the loop
+            if url is not None:
+                await asyncio.to_thread(cache.set, product_id, url)
+            elif self.negative_ttl > 0:
+                await asyncio.to_thread(cache.set, product_id, NO_IMAGE, self.negative_ttl)
+        except Exception as e:
+            print(f"Could not cache the image url of {product_id}: {type(e).__name__}: {e}")
+        return url
+
+    @staticmethod
+    def known(items, cache):
+        # the catalog and cache reads behind lookup; sqlite and diskcache calls, so run off the event loop
+        product_ids = [catalog_store.product_id(item[0]) for item in items]
+        return product_ids, [known_image_url(product_id, cache) for product_id in product_ids]
+
+    async def lookup(self, items, cache):
+        # urls known right away, plus a fetch task for every position that is still None
+        product_ids, urls = await asyncio.to_thread(self.known, items, cache)
+        tasks = {
+            idx: self.resolve(product_ids[idx], cache)
+            for idx in range(len(items)) if urls[idx] is None
+        }
+        return [url or None for url in urls], tasks
+
+    async def get_image_urls(self, items, cache):
+        started = time.perf_counter()
+        urls, tasks = await self.lookup(items, cache)
+        if tasks:
+            await asyncio.wait(set(tasks.values()), timeout=self.deadline)
+
+        # items whose page did not come back before the deadline are returned as None for now
+        for idx, task in tasks.items():
+            if task.done() and not task.cancelled():
+                urls[idx] = task.result()
+            else:
+                metrics.inc("image_deadline_misses_total")
+        metrics.observe("stage_latency_seconds", time.perf_counter() - started, stage="image_resolve")
+        return urls
+
+    async def completed(self, tasks):
+        # yields (key, url) for each fetch as it finishes rather than waiting for the slowest one;
+        # the fetch timeout bounds the whole stream instead of the per-request deadline
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        keys = {}
+        for key, task in tasks.items():
+            keys.setdefault(task, []).append(key)
+
+        pending = set(keys)
+        deadline = loop.time() + self.fetch_timeout
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                url = None if task.cancelled() else task.result()
+                for key in keys[task]:
+                    yield key, url
+
+        metrics.inc("image_deadline_misses_total", sum(len(keys[task]) for task in pending))
+        metrics.observe("stage_latency_seconds", time.perf_counter() - started, stage="image_stream")
+
+
+image_resolver = ImageResolver(
+    concurrency=int(os.environ.get("IMAGE_FETCH_CONCURRENCY", 8)),
+    deadline=float(os.environ.get("IMAGE_FETCH_DEADLINE", 1.0)),
+    negative_ttl=int(os.environ.get("IMAGE_NEGATIVE_TTL", 600)),
+)
@@ -1,25 +1,287 @@
-from fastapi import FastAPI
-from model import get_top_n_unseen_recommendations, get_top_n_seen_recommendations
-from img_url import get_image_urls
+import asyncio
+import hmac
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
 
-app = FastAPI()
-app.state.caches = {}
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+from model import models, purchases, category_items, product_names, scoring_batcher, get_recommendations_batched, get_popular_items, get_similar_items, get_top_n_recommendations_batch
+from data_loader import catalog_store
+from img_url import image_resolver
+from image_cache import ImageCache
+from response_cache import ResponseCache
+from metrics import metrics
+from purchase_log import compact_periodically
+from profiler import profiler
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await image_resolver.start()
+    if int(os.environ.get("MODEL_RELOAD_INTERVAL", 30)) > 0:
+        models.watch(int(os.environ.get("MODEL_RELOAD_INTERVAL", 30)))
+    if float(os.environ.get("PURCHASE_REPLAY_INTERVAL", 1)) > 0:
+        purchases.watch(float(os.environ.get("PURCHASE_REPLAY_INTERVAL", 1)))
+    if int(os.environ.get("PURCHASE_COMPACT_INTERVAL", 0)) > 0:
+        compact_periodically(purchases.log, int(os.environ.get("PURCHASE_COMPACT_INTERVAL", 0)))
+    if os.environ.get("METRICS_DIR"):
+        metrics.watch(os.environ["METRICS_DIR"], float(os.environ.get("METRICS_DUMP_INTERVAL", 5)), gauges)
+    if float(os.environ.get("PROFILE_SAMPLE_RATE", 0)) > 0:
+        profiler.start(float(os.environ.get("PROFILE_SAMPLE_RATE", 0)))
+    yield
+    profiler.stop()
+    await image_resolver.close()
+    app.state.image_cache.close()
+
+app = FastAPI(lifespan=lifespan)
+app.state.response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", 0)) or None,
+)
+# entries are keyed by model version already; clearing on a swap just frees the old version's entries early
+models.on_swap.append(lambda serving_model: app.state.response_cache.clear())
+# a purchase only changes its buyer's lists, in every worker as it replays the log
+purchases.on_event.append(lambda event: app.state.response_cache.invalidate_user(event["user_code"]))
+app.state.image_cache = ImageCache(os.environ.get("IMAGE_CACHE_DIR", "../../../data/cache/images"), ttl=int(os.environ.get("IMAGE_CACHE_TTL", 7 * 24 * 3600)))
 
 @app.get("/")
 def index():
     return {'Hello':'World!'}
 
+async def recommend(user_code, n, category):
+    if category is not None and category not in category_items:
+        raise HTTPException(status_code=404, detail=f"Unknown category {category}")
+
+    started = time.perf_counter()
+    serving_model = models.current
+    key = (user_code, n, serving_model.version, category)
+    recommendations = app.state.response_cache.get(key)
+    cached = recommendations is not None
+    if not cached:
+        # a purchase replayed while this one is being scored invalidates the user first; don't cache behind it
+        generation = app.state.response_cache.generation(user_code)
+        recommendations = await get_recommendations_batched(user_code, n, serving_model=serving_model, category=category)
+        app.state.response_cache.set(key, recommendations, generation)
+    app.state.response_cache.record(cached, time.perf_counter() - started)
+    if cached:
+        metrics.inc("recommendations_total", source="cache")
+    return serving_model, recommendations
+
+
 @app.get("/api/v1/recommend/{user_code}")
-def recommend_items(user_code):
-    seen_recommendations = get_top_n_seen_recommendations(user_code)
-    unseen_recommendations = get_top_n_unseen_recommendations(user_code)
+async def recommend_items(user_code, n: int = Query(default=10, ge=1, le=100), category: str | None = None):
+    started = time.perf_counter()
+    with profiler.request("recommend"):
+        serving_model, (seen_recommendations, unseen_recommendations) = await recommend(user_code, n, category)
 
-    seen_img, app.state.caches = get_image_urls(seen_recommendations, app.state.caches)
-    unseen_img, app.state.caches = get_image_urls(unseen_recommendations, app.state.caches)
+        seen_img, unseen_img = await asyncio.gather(
+            image_resolver.get_image_urls(seen_recommendations, app.state.image_cache),
+            image_resolver.get_image_urls(unseen_recommendations, app.state.image_cache),
+        )
 
+    metrics.observe("request_latency_seconds", time.perf_counter() - started, endpoint="recommend")
     return {
         "seen": seen_recommendations,
         "unseen": unseen_recommendations,
         "seen_img": seen_img,
         "unseen_img": unseen_img,
+        "model_version": serving_model.version,
     }
+
+
+@app.get("/api/v1/recommend/{user_code}/stream")
+async def recommend_items_stream(user_code, n: int = Query(default=10, ge=1, le=100), category: str | None = None):
+    # ndjson: the lists first, with whatever image urls are already known, then one line per image
+    # as its fetch finishes, so the first byte never waits on an outbound request
+    started = time.perf_counter()
+    serving_model, (seen_recommendations, unseen_recommendations) = await recommend(user_code, n, category)
+    (seen_img, seen_tasks), (unseen_img, unseen_tasks) = await asyncio.gather(
+        image_resolver.lookup(seen_recommendations, app.state.image_cache),
+        image_resolver.lookup(unseen_recommendations, app.state.image_cache),
+    )
+    tasks = {("seen", idx): task for idx, task in seen_tasks.items()}
+    tasks.update({("unseen", idx): task for idx, task in unseen_tasks.items()})
+
+    async def events():
+        yield json.dumps({
+            "event": "recommendations",
+            "seen": seen_recommendations,
+            "unseen": unseen_recommendations,
+            "seen_img": seen_img,
+            "unseen_img": unseen_img,
+            "model_version": serving_model.version,
+        }, ensure_ascii=False) + "\n"
+        metrics.observe("time_to_first_line_seconds", time.perf_counter() - started, endpoint="recommend_stream")
+        async for (name, idx), url in image_resolver.completed(tasks):
+            yield json.dumps({"event": "image", "list": name, "index": idx, "url": url}, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": "done"}) + "\n"
+        metrics.observe("request_latency_seconds", time.perf_counter() - started, endpoint="recommend_stream")
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+class BatchRecommendRequest(BaseModel):
+    user_codes: list[str] = Field(max_length=10000)
+    n: int = Field(default=10, ge=1, le=100)
+
+
+@app.post("/api/v1/recommend/batch")
+def recommend_items_batch(request: BatchRecommendRequest):
+    started = time.perf_counter()
+    serving_model = models.current
+    with profiler.request("recommend_batch"):
+        results = get_top_n_recommendations_batch(request.user_codes, request.n, serving_model=serving_model)
+    metrics.observe("request_latency_seconds", time.perf_counter() - started, endpoint="recommend_batch")
+    return {
+        "results": {
+            user_code: {"seen": seen, "unseen": unseen}
+            for user_code, (seen, unseen) in results.items()
+        },
+        "model_version": serving_model.version,
+    }
+
+
+@app.get("/api/v1/popular")
+async def popular_items(
+    n: int = Query(default=10, ge=1, le=100),
+    by: str = Query(default="count", pattern="^(count|rating|trending)$"),
+):
+    started = time.perf_counter()
+    popular = get_popular_items(n, by)
+    popular_img = await image_resolver.get_image_urls(popular, app.state.image_cache)
+    metrics.observe("request_latency_seconds", time.perf_counter() - started, endpoint="popular")
+    return {"popular": popular, "popular_img": popular_img}
+
+
+@app.get("/api/v1/similar/{product_id}")
+async def similar_items(product_id, n: int = Query(default=10, ge=1, le=100)):
+    item_idx = catalog_store.position(product_id)
+    if item_idx is None:
+        raise HTTPException(status_code=404, detail=f"Unknown product {product_id}")
+
+    started = time.perf_counter()
+    serving_model = models.current
+    similar = get_similar_items(item_idx, n, serving_model=serving_model)
+    if similar is None:
+        raise HTTPException(status_code=503, detail=f"No similar items precomputed for model {serving_model.version}")
+    similar_img = await image_resolver.get_image_urls(similar, app.state.image_cache)
+    metrics.observe("request_latency_seconds", time.perf_counter() - started, endpoint="similar")
+    return {
+        "product_id": product_id,
+        "product_name": product_names[item_idx],
+        "similar": similar,
+        "similar_img": similar_img,
+        "model_version": serving_model.version,
+    }
+
+
+class PurchaseEvent(BaseModel):
+    user_code: str
+    product_id: str
+    review_rating: int = Field(ge=1, le=5)
+    review_date: str | None = Field(default=None, pattern=r"^\d{4}\.\d{2}\.\d{2}$")
+
+    @field_validator("review_date")
+    @classmethod
+    def check_review_date(cls, value):
+        # the pattern lets through dates like 2024.13.45, which every worker's replay would then choke on
+        if value is not None:
+            datetime.strptime(value, "%Y.%m.%d")
+        return value
+
+
+class PurchaseRequest(BaseModel):
+    events: list[PurchaseEvent] = Field(min_length=1, max_length=10000)
+
+
+@app.post("/api/v1/purchases")
+def record_purchases(request: PurchaseRequest):
+    unknown = sorted({event.product_id for event in request.events if catalog_store.position(event.product_id) is None})
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown products {', '.join(unknown)}")
+
+    today = time.strftime("%Y.%m.%d")
+    events = [
+        {"user_code": event.user_code, "product_id": event.product_id, "review_rating": event.review_rating, "review_date": event.review_date or today}
+        for event in request.events
+    ]
+    with metrics.timer("purchase_append"):
+        purchases.log.append(events)
+    purchases.replay()
+    metrics.inc("purchases_total", len(events))
+    return {"accepted": len(events)}
+
+
+@app.get("/api/v1/categories")
+def categories():
+    return {category: len(items) for category, items in category_items.items()}
+
+
+@app.get("/api/v1/model")
+def model_info():
+    return {"model_version": models.current.version}
+
+
+@app.get("/api/v1/cache/stats")
+def cache_stats():
+    return {
+        "images": app.state.image_cache.stats(),
+        "responses": app.state.response_cache.stats(),
+    }
+
+
+def gauges():
+    image_stats = app.state.image_cache.stats()
+    response_stats = app.state.response_cache.stats()
+    return {
+        "image_cache_hit_ratio": image_stats["hit_ratio"],
+        "image_cache_entries": image_stats["disk_entries"],
+        "response_cache_hit_ratio": response_stats["hit_ratio"],
+        "response_cache_entries": response_stats["entries"],
+        "scoring_queue_depth": scoring_batcher.waiting if scoring_batcher is not None else 0,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    # METRICS_DIR is set by serve.py when several workers share the port, so any of them can answer for all
+    return metrics.render(gauges(), os.environ.get("METRICS_DIR"))
+
+
+def check_admin(token):
+    # the admin routes don't exist unless ADMIN_TOKEN is set
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token, admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/profile/start")
+def start_profile(
+    rate: float = Query(default=0.1, gt=0, le=1),
+    seconds: float = Query(default=30, gt=0, le=3600),
+    x_admin_token: str | None = Header(default=None),
+):
+    check_admin(x_admin_token)
+    try:
+        path = profiler.start(rate, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"path": path, "rate": rate, "seconds": seconds}
+
+
+@app.post("/admin/profile/stop")
+def stop_profile(x_admin_token: str | None = Header(default=None)):
+    check_admin(x_admin_token)
+    return {"path": profiler.stop()}
+
+
+@app.get("/admin/profile")
+def profile_status(x_admin_token: str | None = Header(default=None)):
+    check_admin(x_admin_token)
+    return profiler.status()
@@ -0,0 +1,165 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # recording is a bisect and three additions under an uncontended lock, cheap enough to leave on
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        # set by profiler.py while a profile is being taken, to label samples with the current stage
+        self.stage_hook = None
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        with self.stage_hook(stage) if self.stage_hook is not None else nullcontext():
+            try:
+                yield
+            finally:
+                self.observe("stage_latency_seconds", time.perf_counter() - started, stage=stage)
+
+    def snapshot(self):
+        with self.lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+        return histograms, counters
+
+    def dump(self, path, gauges=None):
+        # this worker's totals, for whichever worker answers the next scrape; written whole and renamed
+        # into place so a reader never sees half a file
+        histograms, counters = self.snapshot()
+        state = {
+            "histograms": [[name, labels, buckets, counts, total, count] for (name, labels), (buckets, counts, total, count) in histograms.items()],
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "gauges": gauges or {},
+        }
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def watch(self, directory, interval, gauges=None):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(os.path.join(directory, f"{os.getpid()}.json"), gauges() if gauges else None)
+                except Exception as e:
+                    print(f"Metrics dump failed: {type(e).__name__}: {e}")
+
+        os.makedirs(directory, exist_ok=True)
+        thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        thread.start()
+        return thread
+
+    def collect(self, directory, gauges=None, stale_after=60):
+        # sums the counters and histograms every worker has dumped into directory (this one's live values
+        # instead of its file). files of exited workers are kept so totals never go backwards; gauges are
+        # point-in-time, so they are labelled by worker and only kept from files written recently
+        histograms, counters = self.snapshot()
+        worker_gauges = {str(os.getpid()): gauges or {}}
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            worker = os.path.basename(path)[:-len(".json")]
+            if worker == str(os.getpid()):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                modified = os.path.getmtime(path)
+            except (OSError, ValueError):
+                continue
+            for name, labels, buckets, counts, total, count in state["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                if key not in histograms:
+                    histograms[key] = (tuple(buckets), counts, total, count)
+                elif histograms[key][0] == tuple(buckets):
+                    merged = histograms[key]
+                    histograms[key] = (merged[0], [a + b for a, b in zip(merged[1], counts)], merged[2] + total, merged[3] + count)
+            for name, labels, value in state["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            if time.time() - modified < stale_after:
+                worker_gauges[worker] = state["gauges"]
+        return histograms, counters, worker_gauges
+
+    def render(self, gauges=None, directory=None):
+        # prometheus text exposition format; with a directory, for all workers rather than just this one
+        if directory is None:
+            histograms, counters = self.snapshot()
+            gauge_lines = {(name, ()): value for name, value in (gauges or {}).items()}
+        else:
+            histograms, counters, worker_gauges = self.collect(directory, gauges)
+            gauge_lines = {
+                (name, (("worker", worker),)): value
+                for worker, values in worker_gauges.items() for name, value in values.items()
+            }
+        lines = []
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (key_name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if key_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in gauge_lines}):
+            lines.append(f"# TYPE {name} gauge")
+            for (key_name, labels), value in sorted(gauge_lines.items()):
+                if key_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
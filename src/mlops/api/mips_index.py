@@ -0,0 +1,70 @@
+import numpy as np
+
+from scorer import top_n
+
+
+class IVFIndex:
+    def __init__(self, qi, bi, n_lists=None, n_iter=20, seed=0):
+        # bias-augmented item vectors [qi, bi] turn "bi + qi . pu" into one inner product with [pu, 1];
+        # the extra sqrt(M^2 - |x|^2) coordinate puts every item on a sphere of radius M, so the
+        # largest inner product becomes the nearest neighbour and plain k-means lists apply
+        vectors = np.hstack([qi, bi[:, None]])
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        self.max_norm = float(np.sqrt(norms.max())) if len(norms) else 0.0
+        augmented = np.hstack([vectors, np.sqrt(np.maximum(self.max_norm ** 2 - norms, 0.0))[:, None]])
+
+        self.n_items = len(vectors)
+        self.n_lists = max(1, min(n_lists or int(np.sqrt(self.n_items)), self.n_items))
+        self.centroids, assignment = kmeans(augmented, self.n_lists, n_iter, seed)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        order = np.argsort(assignment, kind="stable")
+        self.list_items = order.astype(np.int32)
+        self.list_vectors = vectors[order]
+        self.list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=self.n_lists), out=self.list_offsets[1:])
+
+    def probe_order(self, query):
+        # rank lists by distance from the query scaled onto the same sphere as the items
+        norm = np.linalg.norm(query)
+        scaled = np.append(query * (self.max_norm / norm if norm > 0 else 0.0), 0.0)
+        return np.argsort(self.centroid_norms - 2 * self.centroids @ scaled)
+
+    def query(self, query, n, nprobe, exclude=None):
+        lists = self.probe_order(query)
+        probed = min(max(nprobe, 1), self.n_lists)
+        while True:
+            items, vectors = self._gather(lists[:probed])
+            if exclude is not None:
+                keep = ~exclude[items]
+                items, vectors = items[keep], vectors[keep]
+            # keep probing until there are enough unseen candidates to fill the list
+            if len(items) >= n or probed == self.n_lists:
+                break
+            probed += 1
+
+        scores = vectors @ query
+        picked = top_n(scores, n)
+        return items[picked], scores[picked]
+
+    def _gather(self, lists):
+        ranges = [np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists]
+        rows = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        return self.list_items[rows], self.list_vectors[rows]
+
+
+def kmeans(x, k, n_iter, seed):
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)]
+    sq_norms = np.einsum("ij,ij->i", x, x)
+    for _ in range(n_iter):
+        distances = sq_norms[:, None] - 2 * x @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, x)
+        # empty lists keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    distances = sq_norms[:, None] - 2 * x @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)
+    return centroids, distances.argmin(axis=1)
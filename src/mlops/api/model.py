@@ -1,33 +1,282 @@
-from model_loader import model
-from data_loader import data, product_ids, product_id2name
+import asyncio
+import json
+import os
 
+import numpy as np
 
-def get_seen_items(df, user_code):
-    return set(df[df["user_code"] == user_code]["product_id"])
+from model_loader import ModelRegistry
+from data_loader import SERVING_DIR, load_history, product_ids, product_names, category_items, user_skintypes, catalog_store
+from scorer import top_n
+from seen_index import SeenIndex
+from popularity import FallbackRanking, Popularity, to_days
+from purchase_log import PurchaseLog, PurchaseReplay
+from recommendation_table import TABLE_PATH, artifact_stamp, load_table
+from mips_index import IVFIndex
+from similar_items import SIMILAR_PATH, load_similar
+from metrics import metrics
+from batcher import ScoringBatcher
 
+def load_seen_index():
+    if SERVING_DIR is not None:
+        return SeenIndex.load(os.path.join(SERVING_DIR, "seen_index"))
+    history = load_history()
+    return SeenIndex.from_history(history["user_code"], history["product_id"], product_ids)
 
-def get_top_n_unseen_recommendations(user_code, n=10):
-    seen_items = get_seen_items(data, user_code)
-    unseen_items = [item_id for item_id in product_ids if item_id not in seen_items]
 
-    predictions = []
-    for product_id in unseen_items:
-        pred = model.predict(user_code, product_id2name[product_id]).est
-        predictions.append((product_id2name[product_id], pred))
+def load_fallback_ranking():
+    if SERVING_DIR is not None:
+        return FallbackRanking.load(os.path.join(SERVING_DIR, "fallback"))
+    return FallbackRanking.from_history(load_history(), product_ids, user_skintypes)
 
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    return predictions[:n]
 
+def load_popularity():
+    if SERVING_DIR is not None:
+        return Popularity.load(os.path.join(SERVING_DIR, "popularity"))
+    return Popularity.from_history(load_history(), product_ids)
 
-def get_top_n_seen_recommendations(user_code, n=10):
-    seen_items = get_seen_items(data, user_code)
 
-    predictions = []
-    for product_id in seen_items:
-        pred = model.predict(user_code, product_id2name[product_id]).est
-        predictions.append((product_id2name[product_id], pred))
+def load_log_offset():
+    # how much of the purchase log the seen index and popularity arrays were built with
+    if SERVING_DIR is not None:
+        with open(os.path.join(SERVING_DIR, "log_offset.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["log_offset"]
+    return load_history().attrs.get("log_offset", 0)
 
-    predictions.sort(key=lambda x: x[1], reverse=True)
-    return predictions[:n]
 
+# MIPS_NPROBE > 0 serves unseen recommendations from an IVF index over the item factors instead of
+# scoring the whole catalog; more probed lists trade latency for recall
+mips_nprobe = int(os.environ.get("MIPS_NPROBE", 0))
 
+
+def load_recommendation_table(path, catalog, model_version):
+    # the table saw the purchase log up to the offset precompute.py ran at; anyone who bought after that,
+    # including purchases compacted into the history snapshot since, is scored live instead
+    table = load_table(path, catalog, model_version)
+    if table is not None:
+        table.stale_users = PurchaseLog().user_codes(table.meta.get("log_offset", 0))
+    return table
+
+
+class ServingModel:
+    # everything derived from one model version; a reload builds a new one and swaps it in whole
+    def __init__(self, scorer):
+        self.scorer = scorer
+        self.version = scorer.version
+        self.mips_index = IVFIndex(scorer.qi, scorer.bi, int(os.environ.get("MIPS_LISTS", 0)) or None) if mips_nprobe > 0 else None
+        self.recommendation_table = None
+        self.similar_items = None
+        self.stamps = {}
+        self.refresh()
+
+    def refresh(self):
+        # precompute.py and similar_items.py build their tables from the model already being served, so
+        # they are published after the swap; pick them up (or a rebuild of them) on a later reload tick
+        changed = False
+        for name, path, load in [("recommendation_table", TABLE_PATH, load_recommendation_table), ("similar_items", SIMILAR_PATH, load_similar)]:
+            stamp = artifact_stamp(path)
+            if name in self.stamps and self.stamps[name] == stamp:
+                continue
+            artifact = load(path, product_ids, self.version)
+            self.stamps[name] = stamp
+            changed = changed or artifact is not None or getattr(self, name) is not None
+            setattr(self, name, artifact)
+        return changed
+
+
+# SCORING_BATCH_WINDOW_MS > 0 coalesces concurrent live-scoring requests into one matrix product per window
+scoring_batch_window = float(os.environ.get("SCORING_BATCH_WINDOW_MS", 0)) / 1e3
+scoring_batcher = ScoringBatcher(scoring_batch_window, int(os.environ.get("SCORING_BATCH_SIZE", 64))) if scoring_batch_window > 0 else None
+
+seen_index = load_seen_index()
+fallback_ranking = load_fallback_ranking()
+popularity = load_popularity()
+models = ModelRegistry(ServingModel, product_ids, product_names)
+
+
+def apply_purchase(event):
+    item_idx = catalog_store.position(event["product_id"])
+    if item_idx is None:
+        return
+    # everything that can fail comes before the first update, so a bad event leaves no partial state
+    day = to_days([event["review_date"]])[0]
+    seen_index.add(event["user_code"], item_idx)
+    popularity.add(item_idx, event["review_rating"], day)
+    metrics.inc("purchases_applied_total")
+
+
+purchases = PurchaseReplay(PurchaseLog(), load_log_offset(), apply_purchase)
+purchases.replay()
+
+
+def to_recommendations(scores, idx):
+    return [(product_names[i], float(scores[i])) for i in idx]
+
+
+def top_n_seen_unseen(scores, seen, n):
+    unseen = np.ones(len(scores), dtype=bool)
+    unseen[seen] = False
+    return top_n(scores, n, seen), top_n(scores, n, np.flatnonzero(unseen))
+
+
+def get_top_n_unseen_recommendations_mips(user_code, n=10, nprobe=1, serving_model=None):
+    serving_model = serving_model or models.current
+    scorer = serving_model.scorer
+    with metrics.timer("seen_lookup"):
+        seen = np.zeros(len(product_ids), dtype=bool)
+        seen[seen_index.get(user_code)] = True
+    with metrics.timer("mips_query"):
+        bu, pu = scorer.user_factors(user_code)
+        idx, scores = serving_model.mips_index.query(np.append(pu, 1.0), n, nprobe, exclude=seen)
+    scores = np.clip(scorer.global_mean + bu + scores, scorer.lower_bound, scorer.higher_bound)
+    return [(product_names[i], float(score)) for i, score in zip(idx, scores)]
+
+
+def get_top_n_live_recommendations(user_code, n=10, serving_model=None):
+    # both lists from one scoring pass; with a MIPS index only the user's purchases are scored for the seen list
+    serving_model = serving_model or models.current
+    with metrics.timer("seen_lookup"):
+        seen = seen_index.get(user_code)
+    if serving_model.mips_index is not None:
+        with metrics.timer("score"):
+            scores = serving_model.scorer.subset(seen).score(user_code)
+        with metrics.timer("top_n"):
+            idx = top_n(scores, n)
+        seen_recommendations = [(product_names[seen[i]], float(scores[i])) for i in idx]
+        return seen_recommendations, get_top_n_unseen_recommendations_mips(user_code, n, mips_nprobe, serving_model)
+
+    with metrics.timer("score"):
+        scores = serving_model.scorer.score(user_code)
+    with metrics.timer("top_n"):
+        seen_idx, unseen_idx = top_n_seen_unseen(scores, seen, n)
+    return to_recommendations(scores, seen_idx), to_recommendations(scores, unseen_idx)
+
+
+def get_fallback_recommendations(user_code, n=10, items=None):
+    # users the model never saw get the popularity ranking for their skin type, or the overall one;
+    # it is already sorted, so only the head of the row is touched. items restricts both lists to a category
+    with metrics.timer("seen_lookup"):
+        seen = seen_index.get(user_code)
+        if items is not None:
+            seen = seen[np.isin(seen, items)]
+    with metrics.timer("fallback"):
+        order, scores = fallback_ranking.ranking(user_code)
+        if items is not None:
+            order = order[np.isin(order, items)]
+        head = order[:n + len(seen)]
+        unseen = head[~np.isin(head, seen)][:n]
+        seen = top_n(scores, n, seen)
+    return to_recommendations(scores, seen), to_recommendations(scores, unseen)
+
+
+def get_popular_items(n=10, by="count"):
+    with metrics.timer("popular"):
+        idx, scores = popularity.top(n, by)
+    return to_recommendations(scores, idx)
+
+
+def get_similar_items(item_idx, n=10, serving_model=None):
+    serving_model = serving_model or models.current
+    # read once: the reload thread can replace it on this same serving model at any time
+    similar_items = serving_model.similar_items
+    if similar_items is None:
+        return None
+    with metrics.timer("similar_lookup"):
+        neighbors, similarities = similar_items.lookup(item_idx, n)
+    return [(product_names[i], float(similarity)) for i, similarity in zip(neighbors, similarities)]
+
+
+def get_top_n_recommendations_batch(user_codes, n=10, chunk_size=1024, serving_model=None):
+    # one user-block x item-matrix product per chunk; the chunk bounds the score matrix's memory
+    serving_model = serving_model or models.current
+    results = dict.fromkeys(user_codes)
+    for user_code in results:
+        if user_code not in serving_model.scorer.user_inner_ids:
+            results[user_code] = get_fallback_recommendations(user_code, n)
+    user_codes = [user_code for user_code, result in results.items() if result is None]
+    for start in range(0, len(user_codes), chunk_size):
+        chunk = user_codes[start:start + chunk_size]
+        with metrics.timer("score_batch"):
+            scores = serving_model.scorer.score_many(chunk)
+        with metrics.timer("top_n_batch"):
+            for row, user_code in enumerate(chunk):
+                seen_idx, unseen_idx = top_n_seen_unseen(scores[row], seen_index.get(user_code), n)
+                results[user_code] = (to_recommendations(scores[row], seen_idx), to_recommendations(scores[row], unseen_idx))
+    return results
+
+
+def get_precomputed_recommendations(user_code, n=10, serving_model=None):
+    serving_model = serving_model or models.current
+    # read once: the reload thread can replace it on this same serving model at any time
+    table = serving_model.recommendation_table
+    # the table was built before this user's latest purchases
+    if table is None or user_code in seen_index.added or user_code in table.stale_users:
+        return None
+    with metrics.timer("precomputed_lookup"):
+        rows = table.lookup(user_code, n)
+    if rows is None:
+        return None
+    (seen_idx, seen_scores), (unseen_idx, unseen_scores) = rows
+    return (
+        [(product_names[i], float(score)) for i, score in zip(seen_idx, seen_scores)],
+        [(product_names[i], float(score)) for i, score in zip(unseen_idx, unseen_scores)],
+    )
+
+
+def get_top_n_category_recommendations(user_code, category, n=10, serving_model=None):
+    serving_model = serving_model or models.current
+    items = category_items[category]
+    with metrics.timer("seen_lookup"):
+        # both sides are sorted, so finding the user's purchases inside the category is a binary search each
+        seen = seen_index.get(user_code)
+        positions = np.minimum(np.searchsorted(items, seen), len(items) - 1)
+        seen_positions = positions[items[positions] == seen]
+    with metrics.timer("score"):
+        # gathered per request rather than kept per category: the categories partition the catalog, so resident
+        # subsets would be a private copy of the whole memory-mapped item side in every worker
+        scores = serving_model.scorer.subset(items).score(user_code)
+    with metrics.timer("top_n"):
+        seen_top, unseen_top = top_n_seen_unseen(scores, seen_positions, n)
+    return (
+        [(product_names[items[i]], float(scores[i])) for i in seen_top],
+        [(product_names[items[i]], float(scores[i])) for i in unseen_top],
+    )
+
+
+def get_recommendations(user_code, n=10, serving_model=None, category=None):
+    # the popularity fallback for users the model never saw (within the category, if one is asked for), then
+    # the category scorer, then the precomputed table when it covers this user, live scoring otherwise
+    serving_model = serving_model or models.current
+    if user_code not in serving_model.scorer.user_inner_ids:
+        metrics.inc("recommendations_total", source="fallback")
+        return get_fallback_recommendations(user_code, n, None if category is None else category_items[category])
+    if category is not None:
+        metrics.inc("recommendations_total", source="category")
+        return get_top_n_category_recommendations(user_code, category, n, serving_model)
+    recommendations = get_precomputed_recommendations(user_code, n, serving_model)
+    if recommendations is not None:
+        metrics.inc("recommendations_total", source="precomputed")
+        return recommendations
+    metrics.inc("recommendations_total", source="live")
+    return get_top_n_live_recommendations(user_code, n, serving_model)
+
+
+def split_scores(scores, user_code, n=10):
+    with metrics.timer("top_n"):
+        seen_idx, unseen_idx = top_n_seen_unseen(scores, seen_index.get(user_code), n)
+    return to_recommendations(scores, seen_idx), to_recommendations(scores, unseen_idx)
+
+
+async def get_recommendations_batched(user_code, n=10, serving_model=None, category=None):
+    # same answers as get_recommendations; only the live full-catalog path goes through the batcher.
+    # everything else runs in a worker thread, so neither numpy nor the sqlite lookups hold up the event loop
+    serving_model = serving_model or models.current
+    if scoring_batcher is None or category is not None or serving_model.mips_index is not None or user_code not in serving_model.scorer.user_inner_ids:
+        return await asyncio.to_thread(get_recommendations, user_code, n, serving_model, category)
+    recommendations = await asyncio.to_thread(get_precomputed_recommendations, user_code, n, serving_model)
+    if recommendations is not None:
+        metrics.inc("recommendations_total", source="precomputed")
+        return recommendations
+
+    metrics.inc("recommendations_total", source="batched")
+    scores = await scoring_batcher.score(serving_model.scorer, user_code)
+    return await asyncio.to_thread(split_scores, scores, user_code, n)
@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from scorer import Scorer
+from id_index import SortedIdIndex
+from quantize import DTYPES, QuantizedFactors
+
+FORMAT_VERSION = 1
+MODEL_DIR = "../../../data/model/svd"
+ARRAYS = ["pu", "bu", "qi", "bi", "item_ids", "user_ids", "user_rows"]
+
+
+def export_artifact(scorer, item_ids, model_dir, version, item_dtype="float64"):
+    path = os.path.join(model_dir, version)
+    os.makedirs(path)
+
+    user_ids = np.array(list(scorer.user_inner_ids.keys()), dtype=str)
+    user_rows = np.array(list(scorer.user_inner_ids.values()), dtype=np.int32)
+    order = np.argsort(user_ids)
+    arrays = {
+        "pu": scorer.pu, "bu": scorer.bu, "qi": scorer.qi, "bi": scorer.bi,
+        "item_ids": np.asarray(item_ids, dtype=str), "user_ids": user_ids[order], "user_rows": user_rows[order],
+    }
+    if item_dtype != "float64":
+        # only the item side is reduced: it grows with the catalog and is what every request streams through
+        qi = QuantizedFactors.quantize(scorer.qi, item_dtype)
+        arrays["qi"] = qi.values
+        if qi.scales is not None:
+            np.save(os.path.join(path, "qi_scales.npy"), qi.scales)
+    for name in ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "global_mean": float(scorer.global_mean),
+        "rating_scale": [scorer.lower_bound, scorer.higher_bound],
+        "n_factors": int(scorer.pu.shape[1]),
+        "item_factor_dtype": item_dtype,
+        "n_users": len(user_ids),
+        "n_items": len(item_ids),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    # LATEST is swapped in last so readers never see a half-written version
+    with open(os.path.join(model_dir, "LATEST.tmp"), "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(os.path.join(model_dir, "LATEST.tmp"), os.path.join(model_dir, "LATEST"))
+    return path
+
+
+def latest_version(model_dir=MODEL_DIR):
+    if not os.path.exists(os.path.join(model_dir, "LATEST")):
+        return None
+    with open(os.path.join(model_dir, "LATEST"), "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def load_artifact(path, catalog):
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact format {meta['format_version']} at {path}")
+
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    qi, bi = arrays["qi"], arrays["bi"]
+    if meta.get("item_factor_dtype", "float64") != "float64":
+        scales_path = os.path.join(path, "qi_scales.npy")
+        qi = QuantizedFactors(qi, np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None)
+    if not np.array_equal(arrays["item_ids"], np.asarray(catalog, dtype=str)):
+        # the item side is only shareable when it was exported in catalog order; otherwise fall back
+        # to a private re-laid-out copy
+        print(f"Model artifact at {path} was exported for a different catalog, reindexing item factors")
+        positions = pd.Index(arrays["item_ids"]).get_indexer(np.asarray(catalog, dtype=str))
+        if isinstance(qi, QuantizedFactors):
+            qi = qi.reindex(positions)
+        else:
+            qi = np.where((positions >= 0)[:, None], qi[positions], 0.0)
+        bi = np.where(positions >= 0, bi[positions], 0.0)
+
+    return Scorer(
+        meta["global_mean"], tuple(meta["rating_scale"]), SortedIdIndex(arrays["user_ids"], arrays["user_rows"]),
+        arrays["pu"], arrays["bu"], qi, bi, meta["version"],
+    )
+
+
+if __name__ == "__main__":
+    from data_loader import product_ids, product_names
+    from model_loader import load_model
+
+    version = sys.argv[1] if len(sys.argv) > 1 else time.strftime("%Y%m%d%H%M%S")
+    model_path = sys.argv[2] if len(sys.argv) > 2 else "../../../data/model/model.pkl"
+    item_dtype = sys.argv[3] if len(sys.argv) > 3 else "float64"
+    if item_dtype not in DTYPES:
+        sys.exit(f"item factor dtype must be one of {', '.join(DTYPES)}")
+
+    started = time.time()
+    scorer = Scorer.from_surprise(load_model(model_path), product_names, version)
+    pickle_load = time.time() - started
+
+    path = export_artifact(scorer, product_ids, MODEL_DIR, version, item_dtype)
+
+    started = time.time()
+    load_artifact(path, product_ids)
+    print(f"Exported {path}: load {pickle_load * 1e3:.1f}ms from pickle, {(time.time() - started) * 1e3:.1f}ms memory-mapped")
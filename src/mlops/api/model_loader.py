@@ -1,6 +1,77 @@
+import os
 import pickle
+import threading
+import time
+
+import numpy as np
+
+from scorer import Scorer
+from model_artifact import MODEL_DIR, latest_version, load_artifact
 
 def load_model(filename):
     return pickle.load(open(filename, 'rb'))
 
-model = load_model("../../../data/model/model.pkl")
+def load_scorer(catalog, catalog_names):
+    # prefer the memory-mapped artifact written by model_artifact.py; model.pkl is only unpickled when
+    # no artifact has been exported yet
+    version = latest_version()
+    if version is not None:
+        return load_artifact(os.path.join(MODEL_DIR, version), catalog)
+    return Scorer.from_surprise(load_model("../../../data/model/model.pkl"), catalog_names, "model.pkl")
+
+def validate_scorer(scorer, n_items):
+    n_users, n_factors = scorer.pu.shape
+    if scorer.qi.shape != (n_items, n_factors) or scorer.bi.shape != (n_items,) or scorer.bu.shape != (n_users,):
+        raise ValueError(f"Model {scorer.version} has inconsistent factor shapes")
+    for name in ["pu", "bu", "qi", "bi"]:
+        if not np.isfinite(getattr(scorer, name)).all():
+            raise ValueError(f"Model {scorer.version} has non-finite values in {name}")
+    if not np.isfinite(scorer.global_mean) or not scorer.lower_bound <= scorer.global_mean <= scorer.higher_bound:
+        raise ValueError(f"Model {scorer.version} has a global mean outside its rating scale")
+
+
+class ModelRegistry:
+    def __init__(self, build, catalog, catalog_names):
+        self.build = build
+        self.catalog = catalog
+        self.lock = threading.Lock()
+        self.rejected = None
+        self.on_swap = []
+        self.current = build(load_scorer(catalog, catalog_names))
+
+    def reload(self):
+        # loading, validating and building happen here, off the request path; requests that already
+        # took a reference to the old model finish on it, new requests see the new one
+        with self.lock:
+            version = latest_version()
+            if version is None or version in (self.current.version, self.rejected):
+                # same model, but the tables derived from it may have been published since it was built
+                if not self.current.refresh():
+                    return False
+                print(f"Reloaded derived artifacts for model {self.current.version}")
+            else:
+                try:
+                    scorer = load_artifact(os.path.join(MODEL_DIR, version), self.catalog)
+                    validate_scorer(scorer, len(self.catalog))
+                except Exception:
+                    # don't retry a broken version on every tick; exporting a new one clears this
+                    self.rejected = version
+                    raise
+                self.current = self.build(scorer)
+                print(f"Swapped in model {version}")
+            for callback in self.on_swap:
+                callback(self.current)
+            return True
+
+    def watch(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Keeping model {self.current.version}, reload failed: {type(e).__name__}: {e}")
+
+        thread = threading.Thread(target=run, name="model-reload", daemon=True)
+        thread.start()
+        return thread
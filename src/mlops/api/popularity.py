@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from id_index import SortedIdIndex
+from scorer import top_n
+
+# an item's mean rating is pulled towards the overall mean until it has about this many ratings,
+# so one enthusiastic review does not put an item at the top
+PRIOR_WEIGHT = 10
+# a purchase counts half as much towards the trending score after this many days
+HALF_LIFE_DAYS = 30
+# trending weights are stored relative to an anchor day; past this exponent they are rescaled to a new one
+MAX_EXPONENT = 64
+
+
+def weighted_rating(counts, rating_sums, prior):
+    return (rating_sums + PRIOR_WEIGHT * prior) / (counts + PRIOR_WEIGHT)
+
+
+def to_days(dates):
+    # review_date is "2024.02.06" in the csv and already a datetime in the parquet snapshot
+    return pd.to_datetime(dates, format="%Y.%m.%d").to_numpy("datetime64[s]").astype(np.int64) / 86400
+
+
+class Popularity:
+    # per-item purchase counts, rating sums and time-decayed purchase weights over the whole history,
+    # a few floats per catalog item; new purchases are added in place instead of rescanning the history.
+    # a purchase on day t weighs 2 ** ((t - anchor) / half_life), so older weights never need decaying:
+    # scaling every item by the same factor doesn't change the ranking
+    def __init__(self, counts, rating_sums, decayed, anchor, latest, half_life=HALF_LIFE_DAYS):
+        self.counts = counts
+        self.rating_sums = rating_sums
+        self.decayed = decayed
+        self.anchor = anchor
+        self.latest = latest
+        self.half_life = half_life
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_history(cls, history, catalog, half_life=HALF_LIFE_DAYS):
+        item_idx = pd.Categorical(history["product_id"], categories=catalog).codes
+        known = item_idx >= 0
+        item_idx = item_idx[known]
+        ratings = history["review_rating"].to_numpy(np.float64)[known]
+        days = to_days(history["review_date"])[known]
+
+        latest = float(days.max()) if len(days) else 0.0
+        return cls(
+            np.bincount(item_idx, minlength=len(catalog)),
+            np.bincount(item_idx, weights=ratings, minlength=len(catalog)),
+            np.bincount(item_idx, weights=np.exp2((days - latest) / half_life), minlength=len(catalog)),
+            latest, latest, half_life,
+        )
+
+    def add(self, item_idx, rating, day):
+        with self.lock:
+            if (day - self.anchor) / self.half_life > MAX_EXPONENT:
+                self.decayed *= np.exp2((self.anchor - day) / self.half_life)
+                self.anchor = day
+            self.counts[item_idx] += 1
+            self.rating_sums[item_idx] += rating
+            self.decayed[item_idx] += np.exp2((day - self.anchor) / self.half_life)
+            self.latest = max(self.latest, day)
+
+    def scores(self, by):
+        if by == "count":
+            return self.counts.astype(np.float64)
+        if by == "rating":
+            prior = self.rating_sums.sum() / self.counts.sum() if self.counts.sum() else 0.0
+            return weighted_rating(self.counts, self.rating_sums, prior)
+        if by == "trending":
+            # in purchases as of the latest one, so the number reads the same whatever the anchor is
+            return self.decayed * np.exp2((self.anchor - self.latest) / self.half_life)
+        raise ValueError(f"Unknown popularity ranking {by}")
+
+    def top(self, n, by="count"):
+        with self.lock:
+            scores = self.scores(by)
+        return top_n(scores, n), scores
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "counts.npy"), self.counts)
+        np.save(os.path.join(path, "rating_sums.npy"), self.rating_sums)
+        np.save(os.path.join(path, "decayed.npy"), self.decayed)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"anchor": self.anchor, "latest": self.latest, "half_life": self.half_life}, f)
+
+    @classmethod
+    def load(cls, path):
+        # not memory-mapped: every worker updates its own copy as purchases come in
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, f"{name}.npy")) for name in ["counts", "rating_sums", "decayed"]]
+        return cls(*arrays, meta["anchor"], meta["latest"], meta["half_life"])
+
+
+class FallbackRanking:
+    # the answer for users the model has no factors for: the catalog ranked by rating-weighted popularity,
+    # once over everyone (row 0) and once per skin type, sorted up front so a request only slices a row
+    def __init__(self, segments, user_segments, order, scores):
+        self.segments = segments
+        self.user_segments = user_segments
+        self.order = order
+        self.scores = scores
+
+    @classmethod
+    def from_history(cls, history, catalog, user_skintypes):
+        segments = [""] + sorted(set(user_skintypes.values()))
+        segment_rows = {segment: row for row, segment in enumerate(segments)}
+        user_segments = {user_code: segment_rows[segment] for user_code, segment in user_skintypes.items()}
+
+        item_idx = pd.Categorical(history["product_id"], categories=catalog).codes
+        known = item_idx >= 0
+        rows = pd.Series(user_segments, dtype=np.int64).reindex(history["user_code"]).fillna(0).to_numpy(np.int64)[known]
+        ratings = history["review_rating"].to_numpy(np.float64)[known]
+
+        keys = rows * len(catalog) + item_idx[known]
+        shape = (len(segments), len(catalog))
+        counts = np.bincount(keys, minlength=shape[0] * shape[1]).reshape(shape)
+        rating_sums = np.bincount(keys, weights=ratings, minlength=shape[0] * shape[1]).reshape(shape)
+        # row 0 so far only holds users without a known skin type; make it everyone
+        counts[0] = counts.sum(axis=0)
+        rating_sums[0] = rating_sums.sum(axis=0)
+
+        prior = ratings.mean() if len(ratings) else 0.0
+        scores = weighted_rating(counts, rating_sums, prior)
+        order = np.argsort(-scores, axis=1, kind="stable").astype(np.int32)
+        return cls(segments, user_segments, order, scores)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        user_codes = np.array(list(self.user_segments.keys()), dtype=str)
+        user_rows = np.array(list(self.user_segments.values()), dtype=np.int64)
+        sort = np.argsort(user_codes)
+        np.save(os.path.join(path, "segments.npy"), np.array(self.segments, dtype=str))
+        np.save(os.path.join(path, "user_codes.npy"), user_codes[sort])
+        np.save(os.path.join(path, "user_rows.npy"), user_rows[sort])
+        np.save(os.path.join(path, "order.npy"), self.order)
+        np.save(os.path.join(path, "scores.npy"), self.scores)
+
+    @classmethod
+    def load(cls, path):
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ["segments", "user_codes", "user_rows", "order", "scores"]}
+        return cls(
+            [str(segment) for segment in arrays["segments"]], SortedIdIndex(arrays["user_codes"], arrays["user_rows"]),
+            arrays["order"], arrays["scores"],
+        )
+
+    def ranking(self, user_code):
+        row = self.user_segments.get(user_code, 0)
+        return self.order[row], self.scores[row]
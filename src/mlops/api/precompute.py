@@ -0,0 +1,62 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from model import models, purchases, seen_index, product_ids, top_n_seen_unseen
+from recommendation_table import FORMAT_VERSION, TABLE_PATH, create_table, publish_table
+
+scorer = models.current.scorer
+
+
+def score_chunk(start, user_codes, n):
+    scores = scorer.score_many(user_codes)
+    seen_idx = np.full((len(user_codes), n), -1, dtype=np.int32)
+    unseen_idx = np.full((len(user_codes), n), -1, dtype=np.int32)
+    seen_scores = np.full((len(user_codes), n), np.nan, dtype=np.float64)
+    unseen_scores = np.full((len(user_codes), n), np.nan, dtype=np.float64)
+
+    for row, user_code in enumerate(user_codes):
+        seen_top, unseen_top = top_n_seen_unseen(scores[row], seen_index.get(user_code), n)
+        seen_idx[row, :len(seen_top)], seen_scores[row, :len(seen_top)] = seen_top, scores[row, seen_top]
+        unseen_idx[row, :len(unseen_top)], unseen_scores[row, :len(unseen_top)] = unseen_top, scores[row, unseen_top]
+
+    return start, seen_idx, seen_scores, unseen_idx, unseen_scores
+
+
+def main(n, chunk_size, workers):
+    started = time.time()
+    user_codes = sorted(seen_index.user_rows)
+    tmp_path = f"{TABLE_PATH}.tmp"
+    arrays = create_table(tmp_path, user_codes, product_ids, n)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(score_chunk, start, user_codes[start:start + chunk_size], n)
+            for start in range(0, len(user_codes), chunk_size)
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Score users"):
+            start, seen_idx, seen_scores, unseen_idx, unseen_scores = future.result()
+            end = start + len(seen_idx)
+            arrays["seen_idx"][start:end], arrays["seen_scores"][start:end] = seen_idx, seen_scores
+            arrays["unseen_idx"][start:end], arrays["unseen_scores"][start:end] = unseen_idx, unseen_scores
+
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    publish_table(tmp_path, TABLE_PATH, {"format_version": FORMAT_VERSION, "model_version": scorer.version, "log_offset": purchases.offset, "n": n, "n_users": len(user_codes), "n_items": len(product_ids), "created_at": time.time()})
+    print(f"Precomputed top-{n} recommendations for {len(user_codes)} users in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    main(args.n, args.chunk_size, args.workers)
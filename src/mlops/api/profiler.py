@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from metrics import metrics
+
+PROFILE_DIR = "../../../data/profiles"
+NOT_SAMPLED = nullcontext()
+# the sampled request the running code belongs to; asyncio.to_thread copies it into the worker thread
+current_request = contextvars.ContextVar("profiled_request", default=None)
+
+
+def current_key():
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident(), task
+
+
+def frame_name(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def frame_names(frame, root=None):
+    # outermost first, stopping at root so a request's stack starts at its task instead of the event loop
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        if frame is root:
+            break
+        frame = frame.f_back
+    return names[::-1]
+
+
+def awaiting_names(task):
+    # follow the chain of awaits down from the task's coroutine to wherever it is parked
+    names = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        names.append(frame_name(frame) if frame is not None else f"<{type(coro).__name__}>")
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return names
+
+
+class Profiler:
+    # a statistical profiler for a sampled fraction of requests: a thread wakes every `interval` seconds
+    # and records the stack of each sampled request, under its endpoint and current metrics stage, as
+    # folded stacks for flamegraph.pl or speedscope. while rate is 0 a request costs one comparison
+    def __init__(self, interval=0.005, output_dir=PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.rate = 0.0
+        self.active = {}
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.path = None
+        self.until = None
+
+    def request(self, endpoint):
+        if not self.rate or random.random() >= self.rate:
+            return NOT_SAMPLED
+        return self.sampled(endpoint)
+
+    @contextmanager
+    def sampled(self, endpoint):
+        # entries are [endpoint, stage, delegated]; delegated is set while a worker thread runs for the request
+        key = current_key()
+        entry = self.active[key] = [endpoint, "request", False]
+        token = current_request.set(entry)
+        try:
+            yield
+        finally:
+            current_request.reset(token)
+            self.active.pop(key, None)
+
+    @contextmanager
+    def stage(self, stage):
+        # installed as metrics.stage_hook while profiling, so every metrics.timer stage is attributed
+        key = current_key()
+        entry = self.active.get(key)
+        if entry is None:
+            parent = current_request.get()
+            if parent is None:
+                yield
+                return
+            # a stage the request handed to asyncio.to_thread: sample this thread instead of the parked task
+            self.active[key] = [parent[0], stage, False]
+            parent[2] = True
+            try:
+                yield
+            finally:
+                parent[2] = False
+                self.active.pop(key, None)
+            return
+        previous, entry[1] = entry[1], stage
+        try:
+            yield
+        finally:
+            entry[1] = previous
+
+    def start(self, rate, seconds=None):
+        with self.lock:
+            if self.thread is not None:
+                raise RuntimeError(f"Already profiling into {self.path}")
+            self.stacks = Counter()
+            # workers under serve.py start together; the pid keeps them from overwriting each other's files
+            self.path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+            self.until = time.time() + seconds if seconds else None
+            self.rate = rate
+            metrics.stage_hook = self.stage
+            self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+            self.thread.start()
+            return self.path
+
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return None
+            self.rate = 0.0
+            metrics.stage_hook = None
+            thread, self.thread = self.thread, None
+        thread.join()
+        return self.write()
+
+    def run(self):
+        while self.thread is threading.current_thread():
+            if self.until is not None and time.time() >= self.until:
+                threading.Thread(target=self.stop, daemon=True).start()
+                return
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        frames = sys._current_frames()
+        for (thread_id, task), (endpoint, stage, delegated) in list(self.active.items()):
+            if delegated:
+                continue
+            if task is None:
+                names = frame_names(frames.get(thread_id))
+            elif asyncio.current_task(task.get_loop()) is task:
+                names = frame_names(frames.get(thread_id), task.get_coro().cr_frame)
+            else:
+                # a request parked on an await still counts towards its latency; record where it waits
+                names = awaiting_names(task) + ["(awaiting)"]
+            self.stacks[";".join([endpoint, stage] + names)] += 1
+
+    def write(self):
+        # one folded-stack file per endpoint; the stage is the root frame under it
+        os.makedirs(self.path, exist_ok=True)
+        by_endpoint = {}
+        for stack, count in self.stacks.items():
+            endpoint, _, rest = stack.partition(";")
+            by_endpoint.setdefault(endpoint, []).append(f"{rest} {count}")
+        for endpoint, lines in by_endpoint.items():
+            with open(os.path.join(self.path, f"{endpoint}.folded"), "w", encoding="utf-8") as f:
+                f.write("\n".join(sorted(lines)) + "\n")
+        print(f"Wrote {sum(self.stacks.values())} profile samples to {self.path}")
+        return self.path
+
+    def status(self):
+        return {"running": self.thread is not None, "rate": self.rate, "path": self.path, "samples": sum(self.stacks.values())}
+
+
+profiler = Profiler(interval=float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1e3, output_dir=os.environ.get("PROFILE_DIR", PROFILE_DIR))
@@ -0,0 +1,154 @@
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+PURCHASE_LOG = "../../../data/final/purchases.jsonl"
+
+
+class PurchaseLog:
+    # append-only jsonl of purchase events shared by every worker; byte offsets into it say how much
+    # of it a snapshot or a worker has already taken in
+    def __init__(self, path=PURCHASE_LOG):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        # serialises appends and compaction across worker processes
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, events):
+        lines = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events).encode("utf-8")
+        with self.locked():
+            with open(self.path, "ab") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read(self, offset):
+        # complete lines from offset on, each with the offset just past it, and the offset past the last
+        if not os.path.exists(self.path):
+            return [], offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        lines = []
+        for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):
+            offset += len(line)
+            lines.append((line, offset))
+        return lines, offset
+
+    def user_codes(self, offset):
+        # everyone with a purchase logged from offset on
+        user_codes = set()
+        for line, _ in self.read(offset)[0]:
+            try:
+                user_codes.add(json.loads(line)["user_code"])
+            except (ValueError, KeyError):
+                continue
+        return user_codes
+
+
+class PurchaseReplay:
+    # applies the log to this worker's in-memory state, starting at the offset its snapshot was built at;
+    # the worker that accepted an event replays right away, the others pick it up on their next tick
+    def __init__(self, log, offset, apply):
+        self.log = log
+        self.offset = offset
+        self.apply = apply
+        self.lock = threading.Lock()
+        self.on_event = []
+
+    def replay(self):
+        # the offset moves past each line as it is handled, so a line that can't be applied is logged and
+        # skipped once instead of holding the log (and everything behind it) back
+        with self.lock:
+            applied = 0
+            lines, _ = self.log.read(self.offset)
+            for line, end in lines:
+                try:
+                    event = json.loads(line)
+                    self.apply(event)
+                    applied += 1
+                except Exception as e:
+                    print(f"Skipping purchase at log offset {self.offset}: {type(e).__name__}: {e}")
+                else:
+                    for callback in self.on_event:
+                        callback(event)
+                self.offset = end
+            return applied
+
+    def watch(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.replay()
+                except Exception as e:
+                    print(f"Purchase replay stopped at offset {self.offset}: {type(e).__name__}: {e}")
+
+        thread = threading.Thread(target=run, name="purchase-replay", daemon=True)
+        thread.start()
+        return thread
+
+
+def compact(log):
+    # folds the events past the snapshot's offset into the parquet history; the log itself is kept as
+    # the durable record, and workers started from the new snapshot replay only what came after it
+    from data_loader import HISTORY_COLUMNS, HISTORY_PARQUET, read_history_snapshot, save_history, write_snapshot
+
+    with log.locked():
+        if not os.path.exists(HISTORY_PARQUET):
+            write_snapshot()
+        history, offset = read_history_snapshot()
+        lines, end = log.read(offset)
+        events = []
+        for line, _ in lines:
+            try:
+                event = json.loads(line)
+                datetime.strptime(event["review_date"], "%Y.%m.%d")
+                events.append(event)
+            except Exception as e:
+                print(f"Skipping unreadable purchase in {log.path}: {type(e).__name__}: {e}")
+        if end == offset:
+            return 0
+
+        new = pd.DataFrame(events, columns=HISTORY_COLUMNS)
+        new["review_date"] = pd.to_datetime(new["review_date"], format="%Y.%m.%d")
+        product_ids = history["product_id"].cat.categories
+        history = pd.concat([history.astype({"user_code": str, "product_id": str}), new], ignore_index=True)
+        history["product_id"] = pd.Categorical(history["product_id"], categories=product_ids)
+        history["user_code"] = history["user_code"].astype("category")
+        save_history(history, end)
+    print(f"Compacted {len(events)} purchases into {HISTORY_PARQUET}")
+    return len(events)
+
+
+def compact_periodically(log, interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                compact(log)
+            except Exception as e:
+                print(f"Purchase compaction failed: {type(e).__name__}: {e}")
+
+    thread = threading.Thread(target=run, name="purchase-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["compact"]:
+        compact(PurchaseLog())
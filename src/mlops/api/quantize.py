@@ -0,0 +1,61 @@
+import numpy as np
+
+DTYPES = ["float64", "float16", "int8"]
+# rows widened to float32 per step of a product, which bounds the temporary to BLOCK_ROWS x n_factors
+BLOCK_ROWS = 8192
+
+
+class QuantizedFactors:
+    # item factors kept as float16, or as int8 with one float32 scale per row (row ~= values * scale);
+    # products run block by block on the compact arrays, so a full-precision copy never exists
+    def __init__(self, values, scales=None):
+        self.values = values
+        self.scales = scales
+        self.shape = values.shape
+        self.dtype = values.dtype
+
+    @classmethod
+    def quantize(cls, qi, dtype):
+        qi = np.asarray(qi, dtype=np.float64)
+        if dtype == "float16":
+            return cls(qi.astype(np.float16))
+        if dtype == "int8":
+            scales = np.abs(qi).max(axis=1) / 127
+            values = np.round(np.divide(qi, scales[:, None], out=np.zeros_like(qi), where=scales[:, None] > 0))
+            return cls(values.astype(np.int8), scales.astype(np.float32))
+        raise ValueError(f"Unknown item factor dtype {dtype}")
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, idx):
+        return QuantizedFactors(self.values[idx], None if self.scales is None else self.scales[idx])
+
+    def reindex(self, positions):
+        # positions of -1 become zero rows, like items the model never saw
+        known = positions >= 0
+        values = np.where(known[:, None], self.values[positions], 0).astype(self.values.dtype)
+        scales = None if self.scales is None else np.where(known, self.scales[positions], 0).astype(np.float32)
+        return QuantizedFactors(values, scales)
+
+    def __matmul__(self, x):
+        # qi @ x for a factor vector (n_factors,) or a block of them (n_factors, m)
+        x = np.asarray(x, dtype=np.float32)
+        out = np.empty((len(self.values),) + x.shape[1:], dtype=np.float32)
+        for start in range(0, len(self.values), BLOCK_ROWS):
+            block = slice(start, start + BLOCK_ROWS)
+            out[block] = self.values[block].astype(np.float32) @ x
+            if self.scales is not None:
+                out[block] *= self.scales[block].reshape((-1,) + (1,) * (x.ndim - 1))
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        # a dequantized copy for offline users of the factors (MIPS index build, similar items, validation)
+        values = self.values.astype(np.float64)
+        if self.scales is not None:
+            values *= self.scales[:, None]
+        return values if dtype is None else values.astype(dtype)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (0 if self.scales is None else self.scales.nbytes)
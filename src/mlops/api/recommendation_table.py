@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from id_index import SortedIdIndex
+
+# 2: scores stored as float64; a table hit matches live scoring to within matrix-product rounding (~1e-15)
+FORMAT_VERSION = 2
+TABLE_PATH = "../../../data/model/recommendations"
+ARRAYS = ["user_codes", "item_ids", "seen_idx", "seen_scores", "unseen_idx", "unseen_scores"]
+
+
+class RecommendationTable:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.n = self.meta["n"]
+
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+        self.item_ids = arrays["item_ids"]
+        self.seen_idx, self.seen_scores = arrays["seen_idx"], arrays["seen_scores"]
+        self.unseen_idx, self.unseen_scores = arrays["unseen_idx"], arrays["unseen_scores"]
+        # user_codes is written sorted, so the memory-mapped array doubles as the lookup index
+        self.user_rows = SortedIdIndex(arrays["user_codes"])
+        # users with purchases logged after the table was built; see model.load_recommendation_table
+        self.stale_users = set()
+
+    def lookup(self, user_code, n):
+        row = self.user_rows.get(user_code)
+        if row is None or n > self.n:
+            return None
+        return (
+            self._row(self.seen_idx, self.seen_scores, row, n),
+            self._row(self.unseen_idx, self.unseen_scores, row, n),
+        )
+
+    @staticmethod
+    def _row(idx, scores, row, n):
+        # rows are padded with -1 past the end of a short list
+        idx = idx[row, :n]
+        length = int(np.count_nonzero(idx >= 0))
+        return idx[:length], scores[row, :length]
+
+
+def load_table(path, catalog, model_version):
+    # resolved once, so the meta and the arrays come from the same build even if a new one is published meanwhile
+    path = os.path.realpath(path)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    table = RecommendationTable(path)
+    if table.meta.get("format_version") != FORMAT_VERSION:
+        print(f"Ignoring precomputed recommendations at {path}: unsupported format")
+        return None
+    if table.meta.get("model_version") != model_version:
+        print(f"Ignoring precomputed recommendations at {path}: built for model {table.meta.get('model_version')}, serving {model_version}")
+        return None
+    if not np.array_equal(table.item_ids, np.asarray(catalog, dtype=str)):
+        print(f"Ignoring precomputed recommendations at {path}: built for a different catalog")
+        return None
+    return table
+
+
+def create_table(path, user_codes, item_ids, n):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    shape = (len(user_codes), n)
+    np.save(os.path.join(path, "user_codes.npy"), np.asarray(user_codes, dtype=str))
+    np.save(os.path.join(path, "item_ids.npy"), np.asarray(item_ids, dtype=str))
+
+    arrays = {}
+    for name in ["seen", "unseen"]:
+        arrays[f"{name}_idx"] = np.lib.format.open_memmap(os.path.join(path, f"{name}_idx.npy"), mode="w+", dtype=np.int32, shape=shape)
+        arrays[f"{name}_idx"][:] = -1
+        arrays[f"{name}_scores"] = np.lib.format.open_memmap(os.path.join(path, f"{name}_scores.npy"), mode="w+", dtype=np.float64, shape=shape)
+        arrays[f"{name}_scores"][:] = np.nan
+    return arrays
+
+
+def artifact_stamp(path):
+    # changes whenever a table is published at path, so a server can tell a rebuilt table from the one it loaded
+    meta = os.path.join(path, "meta.json")
+    return os.stat(meta).st_mtime_ns if os.path.exists(meta) else None
+
+
+def publish_table(tmp_path, path, meta):
+    # path is a symlink to the current build and is swapped in a single rename, so a reader never finds it
+    # missing; the build it replaced is deleted only afterwards (memory maps already open on it stay valid)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    target = f"{path}.{time.time_ns()}"
+    os.replace(tmp_path, target)
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # published before path was a symlink; this once it has to be moved aside first
+        previous = f"{target}.old"
+        os.replace(path, previous)
+    os.symlink(os.path.basename(target), f"{path}.link")
+    os.replace(f"{path}.link", path)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
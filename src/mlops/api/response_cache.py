@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class ResponseCache:
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.user_keys = defaultdict(set)
+        # bumped on every invalidation, so a response computed across one is never stored
+        self.epoch = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] < time.time():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def generation(self, user_code):
+        # read before computing a response and passed back to set
+        with self.lock:
+            return self.epoch, self.generations.get(user_code, 0)
+
+    def set(self, key, value, generation=None):
+        # keys start with the user code so a user's entries can be dropped together
+        with self.lock:
+            if generation is not None and generation != (self.epoch, self.generations.get(key[0], 0)):
+                return False
+            self.entries[key] = (value, time.time() + self.ttl if self.ttl else None)
+            self.entries.move_to_end(key)
+            self.user_keys[key[0]].add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+            return True
+
+    def invalidate_user(self, user_code):
+        with self.lock:
+            self.generations[user_code] = self.generations.get(user_code, 0) + 1
+            for key in list(self.user_keys.get(user_code, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+            self.epoch += 1
+            self.generations.clear()
+
+    def _drop(self, key):
+        self.entries.pop(key, None)
+        keys = self.user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[key[0]]
+
+    def record(self, hit, seconds):
+        with self.lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "cached_latency_ms": self.hit_seconds / self.hits * 1e3 if self.hits else None,
+            "uncached_latency_ms": self.miss_seconds / self.misses * 1e3 if self.misses else None,
+        }
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class Scorer:
+    def __init__(self, global_mean, rating_scale, user_inner_ids, pu, bu, qi, bi, version=None):
+        self.global_mean = global_mean
+        self.lower_bound, self.higher_bound = rating_scale
+        self.user_inner_ids = user_inner_ids
+        self.pu, self.bu = pu, bu
+        self.qi, self.bi = qi, bi
+        self.version = version
+
+    @classmethod
+    def from_surprise(cls, model, item_raw_ids, version=None):
+        trainset = model.trainset
+
+        # surprise's SVD keeps the factors in inner-id order; re-lay the item side out in catalog order
+        # and leave zero rows for catalog items the trainset never saw, which is exactly how predict()
+        # falls back to the biases for unknown users and items
+        qi = np.zeros((len(item_raw_ids), model.pu.shape[1]))
+        bi = np.zeros(len(item_raw_ids))
+        for idx, raw_id in enumerate(item_raw_ids):
+            inner_id = trainset._raw2inner_id_items.get(raw_id)
+            if inner_id is not None:
+                qi[idx] = model.qi[inner_id]
+                bi[idx] = model.bi[inner_id]
+
+        return cls(
+            trainset.global_mean, trainset.rating_scale, trainset._raw2inner_id_users,
+            np.asarray(model.pu), np.asarray(model.bu), qi, bi, version,
+        )
+
+    def subset(self, idx):
+        # a scorer over just the given catalog positions; it shares the user side and copies the item rows,
+        # so scoring it costs the size of the subset rather than the whole catalog
+        return Scorer(
+            self.global_mean, (self.lower_bound, self.higher_bound), self.user_inner_ids,
+            self.pu, self.bu, self.qi[idx], self.bi[idx], self.version,
+        )
+
+    def user_factors(self, user_code):
+        inner_id = self.user_inner_ids.get(user_code)
+        if inner_id is None:
+            return 0.0, np.zeros(self.pu.shape[1])
+        return self.bu[inner_id], self.pu[inner_id]
+
+    def score(self, user_code):
+        inner_id = self.user_inner_ids.get(user_code)
+        if inner_id is None:
+            scores = self.global_mean + self.bi
+        else:
+            scores = self.global_mean + self.bu[inner_id] + self.bi + self.qi @ self.pu[inner_id]
+        return np.clip(scores, self.lower_bound, self.higher_bound)
+
+    def score_many(self, user_codes):
+        inner_ids = [self.user_inner_ids.get(user_code) for user_code in user_codes]
+        known = np.array([inner_id is not None for inner_id in inner_ids])
+        rows = np.array([inner_id if inner_id is not None else 0 for inner_id in inner_ids], dtype=np.int64)
+
+        bu = np.where(known, self.bu[rows], 0.0)
+        pu = np.where(known[:, None], self.pu[rows], 0.0)
+        # written as qi @ pu.T so reduced-precision item factors (quantize.py) score the same way
+        scores = (self.global_mean + bu)[:, None] + self.bi + (self.qi @ pu.T).T
+        return np.clip(scores, self.lower_bound, self.higher_bound)
+
+
+def top_n(scores, n, candidates=None):
+    if candidates is not None:
+        scores = scores[candidates]
+    if len(scores) == 0 or n <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if n < len(scores):
+        # argpartition picks an arbitrary subset of tied items at the cut, so widen to every item
+        # scoring at least the n-th best and break ties by position, like the stable sort did
+        threshold = scores[np.argpartition(-scores, n - 1)[n - 1]]
+        picked = np.flatnonzero(scores >= threshold)
+    else:
+        picked = np.arange(len(scores))
+    picked = picked[np.lexsort((picked, -scores[picked]))][:n]
+
+    if candidates is not None:
+        return candidates[picked]
+    return picked
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from id_index import SortedIdIndex
+
+
+class SeenIndex:
+    def __init__(self, user_rows, indptr, indices):
+        self.user_rows = user_rows
+        self.indptr = indptr
+        self.indices = indices
+        # purchases that arrived after the arrays were built, kept beside them since those may be read-only maps
+        self.added = {}
+
+    @classmethod
+    def from_history(cls, user_codes, product_ids, catalog):
+        user_rows, user_codes = pd.factorize(user_codes)
+        item_idx = pd.Categorical(product_ids, categories=catalog).codes
+        known = item_idx >= 0
+
+        # one (user, item) key per purchase, deduplicated and sorted by user then item
+        keys = np.unique(user_rows[known].astype(np.int64) * len(catalog) + item_idx[known])
+        rows = keys // len(catalog)
+        indptr = np.zeros(len(user_codes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(user_codes)), out=indptr[1:])
+        user_rows = {user_code: row for row, user_code in enumerate(user_codes)}
+        return cls(user_rows, indptr, (keys % len(catalog)).astype(np.int32))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        user_codes = np.array(list(self.user_rows.keys()), dtype=str)
+        user_rows = np.array(list(self.user_rows.values()), dtype=np.int64)
+        order = np.argsort(user_codes)
+        np.save(os.path.join(path, "user_codes.npy"), user_codes[order])
+        np.save(os.path.join(path, "user_rows.npy"), user_rows[order])
+        np.save(os.path.join(path, "indptr.npy"), self.indptr)
+        np.save(os.path.join(path, "indices.npy"), self.indices)
+
+    @classmethod
+    def load(cls, path):
+        # memory-mapped read-only, so every worker attached to the same files shares one copy
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in ["user_codes", "user_rows", "indptr", "indices"]}
+        return cls(SortedIdIndex(arrays["user_codes"], arrays["user_rows"]), arrays["indptr"], arrays["indices"])
+
+    def add(self, user_code, item_idx):
+        self.added[user_code] = np.union1d(self.added.get(user_code, self.indices[:0]), [item_idx]).astype(self.indices.dtype)
+
+    def get(self, user_code):
+        row = self.user_rows.get(user_code)
+        items = self.indices[:0] if row is None else self.indices[self.indptr[row]:self.indptr[row + 1]]
+        added = self.added.get(user_code)
+        if added is not None:
+            return np.union1d(items, added)
+        return items
+
+    def __contains__(self, user_code):
+        return user_code in self.user_rows or user_code in self.added
+
+    def __len__(self):
+        return len(self.user_rows) + sum(1 for user_code in self.added if user_code not in self.user_rows)
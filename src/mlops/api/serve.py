@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import psutil
+import requests
+
+SERVING_DIR = "../../../data/serving"
+METRICS_DIR = "../../../data/serving/metrics"
+
+
+def build_shared_state(path):
+    # built once here in the parent; workers only memory-map the result, so the seen-item index and
+    # the product arrays are resident once per host no matter how many workers attach to them
+    from data_loader import load_history, product_ids, user_skintypes, write_products
+    from seen_index import SeenIndex
+    from popularity import FallbackRanking, Popularity
+    from catalog_store import build_catalog_db
+
+    history = load_history()
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "log_offset.json"), "w", encoding="utf-8") as f:
+        json.dump({"log_offset": history.attrs["log_offset"]}, f)
+    SeenIndex.from_history(history["user_code"], history["product_id"], product_ids).save(os.path.join(path, "seen_index"))
+    FallbackRanking.from_history(history, product_ids, user_skintypes).save(os.path.join(path, "fallback"))
+    Popularity.from_history(history, product_ids).save(os.path.join(path, "popularity"))
+    build_catalog_db()
+    write_products(os.path.join(path, "products"))
+
+
+def report_memory(server):
+    # uss is what a worker holds privately; the gap between rss and uss is pages shared with the others
+    print(f"{'pid':>8} {'rss_mb':>8} {'pss_mb':>8} {'uss_mb':>8}")
+    for process in [server] + server.children(recursive=True):
+        memory = process.memory_full_info()
+        print(f"{process.pid:>8} {memory.rss / 2 ** 20:>8.1f} {getattr(memory, 'pss', 0) / 2 ** 20:>8.1f} {memory.uss / 2 ** 20:>8.1f}")
+
+
+def wait_until_ready(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.5)
+    return False
+
+
+def main(host, port, workers, shared):
+    env = dict(os.environ)
+    if shared:
+        started = time.time()
+        build_shared_state(SERVING_DIR)
+        print(f"Built shared serving state in {SERVING_DIR} in {time.time() - started:.1f}s")
+        env["SERVING_DIR"] = SERVING_DIR
+    if workers > 1:
+        # each worker dumps its metrics here and /metrics sums them, whichever worker takes the scrape
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+        env["METRICS_DIR"] = METRICS_DIR
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", host, "--port", str(port), "--workers", str(workers)],
+        env=env,
+    )
+    try:
+        if wait_until_ready(f"http://{host}:{port}/", timeout=120):
+            # give every worker time to finish importing the app before measuring
+            time.sleep(2)
+            report_memory(psutil.Process(server.pid))
+        server.wait()
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--no-shared", dest="shared", action="store_false", help="let every worker load its own copy")
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.workers, args.shared)
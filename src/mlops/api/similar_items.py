@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from recommendation_table import publish_table
+
+FORMAT_VERSION = 1
+SIMILAR_PATH = "../../../data/model/similar"
+
+
+def item_neighbors(qi, k, block_size=4096):
+    # cosine similarity is a dot product of unit-length factors; one block of rows against the whole
+    # catalog at a time keeps the similarity matrix at block_size x n_items
+    norms = np.linalg.norm(qi, axis=1)
+    unit = np.divide(qi, norms[:, None], out=np.zeros_like(qi, dtype=np.float64), where=norms[:, None] > 0)
+    k = min(k, len(qi) - 1)
+    neighbors = np.full((len(qi), k), -1, dtype=np.int32)
+    similarities = np.zeros((len(qi), k), dtype=np.float16)
+
+    for start in range(0, len(qi), block_size):
+        end = min(start + block_size, len(qi))
+        sims = unit[start:end] @ unit.T
+        # items the model never saw have no factors and so no neighbours, and are nobody's neighbour
+        sims[:, norms == 0] = -np.inf
+        sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1, kind="stable")
+        top, top_sims = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_sims, order, axis=1)
+        valid = np.isfinite(top_sims) & (norms[start:end, None] > 0)
+        neighbors[start:end] = np.where(valid, top, -1)
+        similarities[start:end] = np.where(valid, top_sims, 0)
+    return neighbors, similarities
+
+
+class SimilarItems:
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.item_ids = np.load(os.path.join(path, "item_ids.npy"), mmap_mode="r")
+        self.neighbors = np.load(os.path.join(path, "neighbors.npy"), mmap_mode="r")
+        self.similarities = np.load(os.path.join(path, "similarities.npy"), mmap_mode="r")
+
+    def lookup(self, item_idx, n):
+        # rows are padded with -1 past the last item with factors
+        neighbors = self.neighbors[item_idx, :n]
+        length = int(np.count_nonzero(neighbors >= 0))
+        return neighbors[:length], self.similarities[item_idx, :length]
+
+
+def load_similar(path, catalog, model_version):
+    path = os.path.realpath(path)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    similar = SimilarItems(path)
+    if similar.meta.get("format_version") != FORMAT_VERSION:
+        print(f"Ignoring similar items at {path}: unsupported format")
+        return None
+    if similar.meta.get("model_version") != model_version:
+        print(f"Ignoring similar items at {path}: built for model {similar.meta.get('model_version')}, serving {model_version}")
+        return None
+    if not np.array_equal(similar.item_ids, np.asarray(catalog, dtype=str)):
+        print(f"Ignoring similar items at {path}: built for a different catalog")
+        return None
+    return similar
+
+
+def main(k, block_size):
+    from model import models, product_ids
+
+    started = time.time()
+    scorer = models.current.scorer
+    neighbors, similarities = item_neighbors(np.asarray(scorer.qi), k, block_size)
+
+    tmp_path = f"{SIMILAR_PATH}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "item_ids.npy"), np.asarray(product_ids, dtype=str))
+    np.save(os.path.join(tmp_path, "neighbors.npy"), neighbors)
+    np.save(os.path.join(tmp_path, "similarities.npy"), similarities)
+    publish_table(tmp_path, SIMILAR_PATH, {"format_version": FORMAT_VERSION, "model_version": scorer.version, "k": neighbors.shape[1], "n_items": len(product_ids), "created_at": time.time()})
+    print(f"Precomputed {neighbors.shape[1]} neighbours for {len(product_ids)} items in {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--block-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    main(args.k, args.block_size)
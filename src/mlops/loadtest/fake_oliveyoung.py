@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import hashlib
+import random
+
+from aiohttp import web
+
+# stand-in for the oliveyoung product detail pages that img_url.py scrapes, so load test runs never
+# leave the box and their latency does not depend on the real site
+
+PAGE = """<html><body>
+<div class="prd_img"><img src="https://image.oliveyoung.co.kr/uploads/images/goods/{product_id}.jpg" alt="{product_id}"/></div>
+<div class="prd_info">{padding}</div>
+</body></html>"""
+
+
+async def goods_detail(request):
+    options = request.app["options"]
+    product_id = request.query.get("goodsNo", "")
+    # latency and failures are derived from the product id, so every run sees the same slow and broken pages
+    rng = random.Random(hashlib.md5(product_id.encode()).hexdigest())
+    await asyncio.sleep(options.latency + rng.random() * options.jitter)
+    if rng.random() < options.error_rate:
+        return web.Response(status=503, text="unavailable")
+    return web.Response(text=PAGE.format(product_id=product_id, padding="x" * options.page_bytes), content_type="text/html")
+
+
+def make_app(options):
+    app = web.Application()
+    app["options"] = options
+    app.router.add_get("/store/goods/getGoodsDetail.do", goods_detail)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.05, help="base seconds per page")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra seconds per page, up to")
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--page-bytes", type=int, default=200_000, help="padding to make parsing cost realistic")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    web.run_app(make_app(options), host=options.host, port=options.port, print=None)
@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+import numpy as np
+
+
+def load_user_codes(path, count, unknown_ratio, seed):
+    with open(path, "r", encoding="utf-8") as f:
+        known = sorted(json.load(f).values())
+
+    # a fixed seed gives every run the same request sequence, so runs are comparable between commits
+    rng = random.Random(seed)
+    user_codes = []
+    for _ in range(count):
+        if rng.random() < unknown_ratio:
+            user_codes.append("unknown-" + "".join(rng.choices(string.ascii_letters + string.digits, k=24)))
+        else:
+            user_codes.append(rng.choice(known))
+    return user_codes
+
+
+async def run(base_url, user_codes, concurrency, n):
+    queue = asyncio.Queue()
+    for user_code in user_codes:
+        queue.put_nowait(user_code)
+
+    latencies = []
+    statuses = Counter()
+
+    async def worker(session):
+        while not queue.empty():
+            user_code = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.get(f"{base_url}/api/v1/recommend/{user_code}", params={"n": n}) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return np.array(latencies), statuses, elapsed
+
+
+def report(latencies, statuses, elapsed, concurrency):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3
+    print(f"requests={len(latencies)} concurrency={concurrency} elapsed={elapsed:.2f}s")
+    print(f"throughput={len(latencies) / elapsed:.1f} req/s")
+    print(f"latency p50={p50:.1f}ms p95={p95:.1f}ms p99={p99:.1f}ms max={latencies.max() * 1e3:.1f}ms")
+    print(f"statuses={dict(statuses)}")
+
+
+def wait_until_ready(url, timeout=120):
+    async def probe():
+        deadline = time.time() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.time() < deadline:
+                try:
+                    async with session.get(url) as response:
+                        if response.status < 500:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.5)
+        raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+    asyncio.run(probe())
+
+
+def spawn(args, cache_dir):
+    # the API under test talks to the local page stand-in and starts from an empty image cache
+    fake = subprocess.Popen([sys.executable, "fake_oliveyoung.py", "--port", str(args.fake_port)])
+    env = dict(os.environ, OLIVEYOUNG_BASE_URL=f"http://127.0.0.1:{args.fake_port}", IMAGE_CACHE_DIR=cache_dir)
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.api_port), "--workers", str(args.workers)],
+        cwd="../api", env=env,
+    )
+    return [fake, api]
+
+
+def main(args):
+    user_codes = load_user_codes(args.users, args.requests, args.unknown_ratio, args.seed)
+    processes = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        try:
+            base_url = args.url
+            if args.spawn:
+                processes = spawn(args, cache_dir)
+                base_url = f"http://127.0.0.1:{args.api_port}"
+                wait_until_ready(f"http://127.0.0.1:{args.fake_port}/store/goods/getGoodsDetail.do")
+            wait_until_ready(f"{base_url}/")
+
+            if args.warmup:
+                asyncio.run(run(base_url, user_codes[:args.warmup], args.concurrency, args.n))
+            latencies, statuses, elapsed = asyncio.run(run(base_url, user_codes, args.concurrency, args.n))
+            report(latencies, statuses, elapsed, args.concurrency)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", default="../../../data/final/user_id2code.json")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--unknown-ratio", type=float, default=0.1)
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=0, help="requests to send before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn", action="store_true", help="start fake_oliveyoung.py and the API locally for a hermetic run")
+    parser.add_argument("--api-port", type=int, default=8001)
+    parser.add_argument("--fake-port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    main(args)
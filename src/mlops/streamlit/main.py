@@ -1,22 +1,26 @@
 import streamlit as st
 import json
+import sqlite3
 import requests
 
 
-def read_json():
-    with open("../../../data/final/user_id2code.json", "r", encoding="utf-8") as file:
-        user_id2code = json.load(file)
-        return user_id2code
+def open_catalog():
+    # the same catalog.db the API reads, written by src/mlops/api/catalog_store.py
+    return sqlite3.connect("file:../../../data/final/catalog.db?mode=ro", uri=True, check_same_thread=False)
+
+def lookup(sql, *args):
+    row = st.session_state.catalog.execute(sql, args).fetchone()
+    return row[0] if row else None
 
 def check_credentials(username):
-    return username in st.session_state.user_id2code
+    return lookup("SELECT user_code FROM users WHERE user_id = ?", username) is not None
 
 def login_page():
     st.title("올리브영 추천시스템 Login")
     username = st.text_input("Username")
     if st.button("Login"):
         if check_credentials(username):
-            st.session_state.usercode = st.session_state.user_id2code[username]
+            st.session_state.usercode = lookup("SELECT user_code FROM users WHERE user_id = ?", username)
             st.session_state.logged_in = True
             st.session_state.username = username
             st.rerun()
@@ -31,13 +35,21 @@ def get_recommendations(category):
     imgs = [ item for item in result[f"{category}_img"] ]
     return items, imgs
 
+def get_popular_items():
+    response = requests.get("http://127.0.0.1:8000/api/v1/popular", timeout=10)
+    result = json.loads(response.text)
+
+    items = [ item[0] for item in result["popular"] ]
+    imgs = [ item for item in result["popular_img"] ]
+    return items, imgs
+
 def display_recommendations(title, items, imgs):
     st.subheader(title)
     print(imgs)
     items_html = ''.join([
         f'''<div class="item">
         <figure>
-        <a href="https://www.oliveyoung.co.kr/store/goods/getGoodsDetail.do?goodsNo={st.session_state.product_name2id[item]}">
+        <a href="https://www.oliveyoung.co.kr/store/goods/getGoodsDetail.do?goodsNo={lookup("SELECT product_id FROM products WHERE name = ?", item)}">
         <img src={img} />
         </a>
         <figcaption>{item}</figcaption>
@@ -87,7 +99,7 @@ def user_main_page():
         display_recommendations("아직까지 구매하지 않았던 제품 추천!!", unseen_items, unseen_imgs)
 
     with st.container(border=True):
-        alltime_best, alltime_img = get_recommendations("seen")
+        alltime_best, alltime_img = get_popular_items()
         display_recommendations("올리브영에서 가장 인기있는 제품 추천!!", alltime_best, alltime_img)
 
     if st.button("Refresh Recommendations"):
@@ -107,6 +119,6 @@ def main():
         login_page()
 
 if __name__ == "__main__":
-    if "user_id2code" not in st.session_state:
-        st.session_state.user_id2code = read_json()
+    if "catalog" not in st.session_state:
+        st.session_state.catalog = open_catalog()
     main()